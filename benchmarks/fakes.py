@@ -0,0 +1,300 @@
+# Stand-ins for X, YouTube and Gemini used by the benchmarks. The db stand-in
+# is db.InMemory.
+import asyncio
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+from deadline import call_timeout, retry
+from misc import TSBMessage, Status
+from msg_platform import BasePlatform
+from rate_limit import get_limiter
+from youtube_id_to_timestamps import (
+    DEFAULT_GEMINI_TIMEOUT_SEC,
+    DEFAULT_LONG_VIDEO_CONCURRENCY,
+    DEFAULT_LONG_VIDEO_SEC,
+    DEFAULT_TIMESTAMPS_WORKERS,
+    DEFAULT_TRANSCRIPT_TIMEOUT_SEC,
+    TranscriptUnavailable,
+)
+
+
+class FakeRateLimitError(Exception):
+    code = 429
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.response = SimpleNamespace(headers={"Retry-After": str(retry_after)})
+
+
+class FakePlatform(BasePlatform):
+    # Mentions are added with add_mentions() and returned by gather_messages()
+    # once their arrival time has passed. Replies are only recorded.
+    def __init__(self, reply_latency=0.05, page_size=100):
+        self.reply_latency = reply_latency
+        self.page_size = page_size
+        self.mentions: List[TSBMessage] = []
+        self.arrived_at: Dict[str, float] = {}
+        self.replied_at: Dict[str, float] = {}
+        self.replies: Dict[str, str] = {}
+        self._next_msg_id = 1_000_000
+
+    def add_mentions(
+        self, video_ids: List[Optional[str]], users: List[str], arrive_at=None
+    ):
+        # A video id of None is a mention without a YouTube link.
+        arrive_at = time.monotonic() if arrive_at is None else arrive_at
+        for video_id, user in zip(video_ids, users):
+            self._next_msg_id += 1
+            msg_id = str(self._next_msg_id)
+            link = "hello" if video_id is None else f"https://youtu.be/{video_id}"
+            self.mentions.append(
+                TSBMessage(
+                    status=Status.empty.value,
+                    msg_text=f"@TimeStampBuddy {link}",
+                    msg_from=user,
+                    msg_id=msg_id,
+                )
+            )
+            self.arrived_at[msg_id] = arrive_at
+
+    async def get_original_url(self, message_text: str) -> str:
+        return message_text.split()[-1]
+
+    async def gather_messages(self, since_message_id: str) -> List[TSBMessage]:
+        messages = []
+        async for page in self.iter_messages(since_message_id):
+            messages.extend(page)
+        return messages
+
+    async def iter_messages(self, since_message_id: str):
+        now = time.monotonic()
+        since = int(since_message_id or 0)
+        # newest first, like X
+        visible = [
+            m
+            for m in reversed(self.mentions)
+            if int(m.msg_id) > since and self.arrived_at[m.msg_id] <= now
+        ]
+        for i in range(0, len(visible), self.page_size):
+            yield visible[i : i + self.page_size]
+
+    async def reply(self, text: str, platform_message_id: str) -> None:
+        async with get_limiter("x_reply").aslot():
+            await asyncio.sleep(self.reply_latency)
+        self.replies[str(platform_message_id)] = text
+        self.replied_at[str(platform_message_id)] = time.monotonic()
+
+    def get_max_response_length(self) -> int:
+        return 280
+
+
+class FakeEngine:
+    # Replaces YoutubeIdToTimestamps. Videos whose id starts with "L" are 3h
+    # long. Like the real engine, the calls run on an executor, behind the same
+    # rate limiters, with the same timeouts and retries (deadline.retry), so
+    # the 429s and the hangs go through the real recovery path. Latencies are
+    # log-normal around the given means (in seconds), and a hang_rate share of
+    # the transcript requests only end with their timeout. The random draws
+    # depend only on the video and on the attempt, not on the order of the
+    # calls, so runs with different scheduling get the same work to do.
+    def __init__(
+        self,
+        transcript_latency=0.1,
+        llm_latency=0.4,
+        long_video_factor=10,
+        error_rate=0.0,
+        rate_limit_rate=0.0,
+        hang_rate=0.0,
+        retry_after=1,
+        seed=0,
+    ):
+        self.transcript_latency = transcript_latency
+        self.llm_latency = llm_latency
+        self.long_video_factor = long_video_factor
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.hang_rate = hang_rate
+        self.retry_after = retry_after
+        self.seed = seed
+        self.max_response_length = 280
+        self.calls = 0
+        self.attempts: Dict[str, int] = {}
+        self.executor = ThreadPoolExecutor(
+            max_workers=int(
+                os.environ.get("TIMESTAMPS_WORKERS", DEFAULT_TIMESTAMPS_WORKERS)
+            ),
+            thread_name_prefix="fake-engine",
+        )
+
+    def _latency(self, rnd, mean):
+        return rnd.lognormvariate(0, 0.5) * mean / 1.13
+
+    def _fetch_transcript(self, rnd, deadline):
+        timeout = call_timeout(
+            float(
+                os.environ.get("TRANSCRIPT_TIMEOUT_SEC", DEFAULT_TRANSCRIPT_TIMEOUT_SEC)
+            ),
+            deadline,
+        )
+        with get_limiter("youtube").slot():
+            if rnd.random() < self.hang_rate:
+                time.sleep(timeout)
+                raise TimeoutError("Fake transcript request timed out")
+            time.sleep(min(self._latency(rnd, self.transcript_latency), timeout))
+
+    def get_transcript(self, youtube_id: str, deadline=None):
+        attempt = self.attempts[youtube_id] = self.attempts.get(youtube_id, 0) + 1
+        rnd = random.Random(f"{self.seed}:{youtube_id}:{attempt}:transcript")
+        retry(
+            f"{youtube_id} - transcript",
+            lambda: self._fetch_transcript(rnd, deadline),
+            deadline,
+        )
+        end = 3 * 60 * 60 if youtube_id.startswith("L") else 20 * 60
+        return [[0, f"transcript of {youtube_id}"]], end
+
+    def is_long_video(self, end: int) -> bool:
+        return is_long_video(end)
+
+    def _request_chapters(self, rnd, mean, deadline):
+        timeout = call_timeout(
+            float(os.environ.get("GEMINI_TIMEOUT_SEC", DEFAULT_GEMINI_TIMEOUT_SEC)),
+            deadline,
+        )
+        with get_limiter("gemini").slot():
+            latency = self._latency(rnd, mean)
+            time.sleep(min(latency, timeout))
+            if latency > timeout:
+                raise TimeoutError("Fake LLM request timed out")
+            if rnd.random() < self.rate_limit_rate:
+                raise FakeRateLimitError(
+                    "429 Resource has been exhausted", self.retry_after
+                )
+            if rnd.random() < self.error_rate:
+                raise Exception("Fake LLM error")
+
+    def get_chapters(self, youtube_id: str, windows, end: int, deadline=None) -> str:
+        attempt = self.attempts.get(youtube_id, 1)
+        rnd = random.Random(f"{self.seed}:{youtube_id}:{attempt}")
+        factor = self.long_video_factor if self.is_long_video(end) else 1
+        retry(
+            f"{youtube_id} - chapters",
+            lambda: self._request_chapters(rnd, self.llm_latency * factor, deadline),
+            deadline,
+        )
+        return f"0:00 - Intro of {youtube_id}\n5:00 - Main part\n10:00 - Outro"
+
+    async def get_transcript_async(self, youtube_id: str, deadline=None):
+        self.calls += 1
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, self.get_transcript, youtube_id, deadline
+        )
+
+    async def get_chapters_async(
+        self, youtube_id: str, windows, end: int, deadline=None
+    ) -> str:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, self.get_chapters, youtube_id, windows, end, deadline
+        )
+
+
+class TraceEngine:
+    # Replaces YoutubeIdToTimestamps with the calls recorded for each video in a
+    # trace (see benchmarks/replay.py), `speed` times faster. The transcript
+    # fetches and the Gemini requests are replayed behind the same rate limiters,
+    # failed attempts included. The chunks of long videos are requested
+    # concurrently, like in production, the rest one after the other. The
+    # videos missing from the trace get the calls of a typical video.
+    def __init__(self, videos: Dict[str, dict], speed=1):
+        self.videos = videos
+        self.speed = speed
+        self.max_response_length = 280
+        self.calls = 0
+        self.typical = typical_video(videos.values())
+
+    async def get_transcript_async(self, youtube_id: str, deadline=None):
+        self.calls += 1
+        video = self.videos.get(youtube_id, self.typical)
+        for sec, ok in video["fetches"]:
+            async with get_limiter("youtube").aslot():
+                await asyncio.sleep(sec / self.speed)
+        if video["result"] == "unavailable":
+            raise TranscriptUnavailable("Recorded as unavailable")
+        # as many windows and characters as the real transcript
+        count = max(video["windows"], 1)
+        text = "x" * (video["chars"] // count)
+        return [(i * video["end"] // count, text) for i in range(count)], video["end"]
+
+    def is_long_video(self, end: int) -> bool:
+        return is_long_video(end)
+
+    async def _request(self, sec, tokens):
+        async with get_limiter("gemini").aslot(tokens=tokens):
+            await asyncio.sleep(sec / self.speed)
+
+    async def get_chapters_async(
+        self, youtube_id: str, windows, end: int, deadline=None
+    ) -> str:
+        video = self.videos.get(youtube_id, self.typical)
+        if self.is_long_video(end):
+            concurrency = int(
+                os.environ.get(
+                    "LONG_VIDEO_CONCURRENCY", DEFAULT_LONG_VIDEO_CONCURRENCY
+                )
+            )
+            semaphore = asyncio.Semaphore(max(concurrency, 1))
+
+            async def request_chunk(sec, tokens):
+                async with semaphore:
+                    await self._request(sec, tokens)
+
+            await asyncio.gather(
+                *(request_chunk(sec, tokens) for sec, tokens, _ in video["llm"])
+            )
+        else:
+            for sec, tokens, _ in video["llm"]:
+                await self._request(sec, tokens)
+        if video["result"] != "ok":
+            raise Exception("Recorded as failed")
+        return f"0:00 - Intro of {youtube_id}\n5:00 - Main part\n10:00 - Outro"
+
+
+def is_long_video(end: int) -> bool:
+    # Same rule (and setting) as YoutubeIdToTimestamps.is_long_video.
+    long_video_sec = int(os.environ.get("LONG_VIDEO_SEC", DEFAULT_LONG_VIDEO_SEC))
+    return bool(long_video_sec) and end > long_video_sec
+
+
+def typical_video(videos) -> dict:
+    # The answered video with the median total time of its calls.
+    def total(video):
+        return sum(sec for sec, _ in video["fetches"]) + sum(
+            sec for sec, _, _ in video["llm"]
+        )
+
+    answered = sorted(
+        (v for v in videos if v["result"] == "ok" and v["llm"]), key=total
+    )
+    if answered:
+        return answered[len(answered) // 2]
+    return {
+        "fetches": [[0.5, True]],
+        "llm": [[5.0, 0, True]],
+        "end": 20 * 60,
+        "windows": 40,
+        "chars": 20000,
+        "result": "ok",
+    }
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(round(p / 100 * (len(values) - 1))), len(values) - 1)]
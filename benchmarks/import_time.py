@@ -0,0 +1,126 @@
+# Measures how long a fresh interpreter takes to get to the first poll (what a
+# restarted Space pays before it collects anything) and checks it against a
+# budget. That's everything main() imports before its first request: the
+# cron_processor module, the db backend in use and the Twitter platform, with
+# their SDKs (supabase, tweepy). The Gemini and YouTube SDKs must not be
+# imported at that point, they are preloaded in the background while the
+# collector already polls.
+#
+#   python -m benchmarks.import_time
+#   python -m benchmarks.import_time --backend sqlite --budget-ms 600 --top 20
+#
+# The exit code is 1 if the startup is over budget or loads one of the engine
+# SDKs.
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ENGINE_MODULES = [
+    "google.generativeai",
+    "youtube_transcript_api",
+]
+
+# DB_BACKEND -> class, as picked by cron_processor.create_db
+BACKENDS = {"supabase": "Supabase", "sqlite": "SQLite", "memory": "InMemory"}
+
+STEPS = """
+import cron_processor
+from db import {backend}
+from msg_platform import Twitter
+"""
+
+MEASURE = """
+import json, sys, time
+steps = []
+started = time.perf_counter()
+for step in {steps!r}:
+    step_started = time.perf_counter()
+    exec(step)
+    steps.append((step, (time.perf_counter() - step_started) * 1000))
+elapsed = time.perf_counter() - started
+print(json.dumps({{
+    "ms": elapsed * 1000,
+    "steps": steps,
+    "loaded": [m for m in {modules!r} if m in sys.modules],
+}}))
+"""
+
+
+def get_steps(backend):
+    return STEPS.format(backend=BACKENDS[backend]).strip().splitlines()
+
+
+def measure(steps):
+    script = MEASURE.format(steps=steps, modules=ENGINE_MODULES)
+    output = subprocess.run(
+        [sys.executable, "-c", script], check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def top_packages(steps, count):
+    # -X importtime lines: "import time: self [us] | cumulative | imported package"
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "\n".join(steps)],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stderr
+    rows = []
+    for line in stderr.splitlines():
+        parts = line.removeprefix("import time:").split("|")
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            rows.append((int(parts[0]) / 1000, parts[2][1:].rstrip()))
+    # The self time of the modules is summed by top level package, skipping the
+    # interpreter startup, which ends with site.
+    if any(name == "site" for _, name in rows):
+        rows = rows[[name for _, name in rows].index("site") + 1 :]
+    packages = {}
+    for self_ms, name in rows:
+        package = name.strip().split(".")[0]
+        packages[package] = packages.get(package, 0) + self_ms
+    return sorted(((ms, name) for name, ms in packages.items()), reverse=True)[
+        :count
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--backend",
+        choices=sorted(BACKENDS),
+        default=os.environ.get("DB_BACKEND", "supabase"),
+    )
+    parser.add_argument("--budget-ms", type=float, default=1000)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    steps = get_steps(args.backend)
+    results = [measure(steps) for _ in range(args.runs)]
+    ms = statistics.median(r["ms"] for r in results)
+    loaded = sorted({m for r in results for m in r["loaded"]})
+
+    print(f"until the first poll: {ms:.0f} ms (median of {args.runs}), budget {args.budget_ms:.0f} ms")
+    for i, step in enumerate(steps):
+        step_ms = statistics.median(r["steps"][i][1] for r in results)
+        print(f"  {step_ms:8.1f} ms  {step}")
+    print("slowest packages:")
+    for package_ms, name in top_packages(steps, args.top):
+        print(f"  {package_ms:8.1f} ms  {name}")
+    failed = False
+    if loaded:
+        print(f"FAIL engine SDKs imported before the first poll: {', '.join(loaded)}")
+        failed = True
+    if ms > args.budget_ms:
+        print("FAIL over budget")
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
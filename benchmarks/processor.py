@@ -0,0 +1,241 @@
+# End-to-end benchmark of CronProcessor (collector + processor) against the
+# stand-ins from benchmarks.fakes and db.InMemory. Each scenario runs in its own
+# process so the peak RSS is per scenario.
+#
+#   python -m benchmarks.processor
+#   python -m benchmarks.processor --scenario trending --max-parallel 8
+#   python -m benchmarks.processor --save baseline.json
+#   python -m benchmarks.processor --baseline baseline.json --tolerance 0.2
+#
+# With --baseline, the exit code is 1 if the p95 latency or the throughput of a
+# scenario got worse than the tolerance allows.
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+
+from benchmarks.fakes import FakeEngine, FakePlatform, percentile
+from cron_processor import CronProcessor
+from db import InMemory
+from misc import Status
+
+SCENARIOS = {
+    # unique videos arriving steadily
+    "steady": dict(mentions=200, videos=200, users=100, arrival_sec=5),
+    # a few viral videos, lots of duplicate mentions
+    "trending": dict(mentions=200, videos=3, users=150, arrival_sec=2),
+    # 30% of the videos are long (10x slower to chapter)
+    "long_videos": dict(mentions=60, videos=60, users=40, arrival_sec=2, long_ratio=0.3),
+    # one user posts 60 mentions (of different videos) just before 60 from the others
+    "spammer": dict(mentions=60, videos=60, users=30, arrival_sec=3, spam=60),
+    # Gemini answers 30% of the calls with a 429 (Retry-After: 1)
+    "429_storm": dict(
+        mentions=100,
+        videos=100,
+        users=50,
+        arrival_sec=2,
+        engine=dict(rate_limit_rate=0.3),
+    ),
+    # 5% of the transcript requests hang until their timeout (cut to what is
+    # left of MESSAGE_DEADLINE_SEC) and are retried
+    "hangs": dict(
+        mentions=100,
+        videos=100,
+        users=50,
+        arrival_sec=2,
+        engine=dict(hang_rate=0.05),
+        env=dict(MESSAGE_DEADLINE_SEC="10"),
+    ),
+}
+
+FINAL_STATUSES = {
+    Status.answered.value,
+    Status.invalid.value,
+    Status.failed_timestamps.value,
+    Status.failed_reply.value,
+}
+
+
+def video_ids(count, long_ratio, rnd):
+    ids = []
+    for i in range(count):
+        # 11 characters, like real YouTube ids
+        prefix = "L" if rnd.random() < long_ratio else "v"
+        ids.append(f"{prefix}{i:010d}")
+    return ids
+
+
+async def run_scenario(name, max_parallel, timeout, seed=1):
+    config = SCENARIOS[name]
+    os.environ.update(
+        {
+            "COLLECT_CRON_INTERVAL_SEC": "1",
+            "PROCESSOR_IDLE_INTERVAL_SEC": "1",
+            "PROCESSOR_ACTIVE_INTERVAL_SEC": "0",
+            "MAX_PARALLEL_MESSAGES": str(max_parallel),
+            **config.get("env", {}),
+        }
+    )
+    rnd = random.Random(seed)
+    db = InMemory()
+    platform = FakePlatform()
+    engine = FakeEngine(seed=seed, **config.get("engine", {}))
+    processor = CronProcessor(db, platform, engine)
+
+    videos = video_ids(config["videos"], config.get("long_ratio", 0), rnd)
+    users = [f"user{i}" for i in range(config["users"])]
+    started = time.monotonic()
+    for i in range(config.get("spam", 0)):
+        platform.add_mentions([f"s{i:010d}"], ["spammer"], started)
+    arrivals = sorted(
+        started + rnd.uniform(0, config["arrival_sec"])
+        for _ in range(config["mentions"])
+    )
+    for arrive_at in arrivals:
+        platform.add_mentions([rnd.choice(videos)], [rnd.choice(users)], arrive_at)
+
+    mentions = len(platform.mentions)
+    tasks = [
+        asyncio.create_task(processor.collect_platform_messages()),
+        asyncio.create_task(processor.run_data_processor()),
+    ]
+    deadline = started + timeout
+    while time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+        if len(db.messages) == mentions and all(
+            m.status in FINAL_STATUSES for m in db.messages.values()
+        ):
+            break
+    finished = time.monotonic()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    latencies = [
+        platform.replied_at[msg_id] - platform.arrived_at[msg_id]
+        for msg_id in platform.replied_at
+    ]
+    statuses = {}
+    for m in db.messages.values():
+        status = Status(m.status).name
+        statuses[status] = statuses.get(status, 0) + 1
+    elapsed = finished - started
+    # until the last reply, the statuses can reach the db a bit later
+    replying = max(platform.replied_at.values(), default=finished) - started
+    return {
+        "scenario": name,
+        "max_parallel": max_parallel,
+        "mentions": mentions,
+        "answered": len(latencies),
+        "statuses": statuses,
+        "timed_out": finished >= deadline,
+        "elapsed_sec": round(elapsed, 3),
+        "throughput_per_min": round(len(latencies) / replying * 60, 1),
+        "p50_sec": percentile(latencies, 50),
+        "p95_sec": percentile(latencies, 95),
+        "p99_sec": percentile(latencies, 99),
+        "engine_calls": engine.calls,
+        # KB on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def run_in_subprocess(name, args):
+    output = subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "benchmarks.processor",
+            "--scenario",
+            name,
+            "--max-parallel",
+            str(args.max_parallel),
+            "--timeout",
+            str(args.timeout),
+            "--json",
+        ],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def fmt(value):
+    return "-" if value is None else f"{value:.3f}"
+
+
+def print_results(results):
+    print(
+        f"{'scenario':<12} {'answered':>9} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} "
+        f"{'msg/min':>8} {'llm calls':>9} {'rss MB':>7}  statuses"
+    )
+    for r in results:
+        print(
+            f"{r['scenario']:<12} {r['answered']:>4}/{r['mentions']:<4} "
+            f"{fmt(r['p50_sec']):>7} {fmt(r['p95_sec']):>7} {fmt(r['p99_sec']):>7} "
+            f"{r['throughput_per_min']:>8} {r['engine_calls']:>9} {r['peak_rss_mb']:>7}  "
+            f"{r['statuses']}{' TIMED OUT' if r['timed_out'] else ''}"
+        )
+
+
+def find_regressions(results, baseline, tolerance):
+    regressions = []
+    baseline = {r["scenario"]: r for r in baseline}
+    for r in results:
+        base = baseline.get(r["scenario"])
+        if base is None:
+            continue
+        if base["p95_sec"] and (r["p95_sec"] or 0) > base["p95_sec"] * (1 + tolerance):
+            regressions.append(
+                f"{r['scenario']}: p95 {fmt(r['p95_sec'])}s vs {fmt(base['p95_sec'])}s"
+            )
+        if r["throughput_per_min"] < base["throughput_per_min"] * (1 - tolerance):
+            regressions.append(
+                f"{r['scenario']}: throughput {r['throughput_per_min']}/min "
+                f"vs {base['throughput_per_min']}/min"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS))
+    parser.add_argument("--max-parallel", type=int, default=4)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--json", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--save")
+    parser.add_argument("--baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    if args.json:
+        logging.basicConfig(level=logging.CRITICAL)
+        result = asyncio.run(
+            run_scenario(args.scenario[0], args.max_parallel, args.timeout)
+        )
+        print(json.dumps(result))
+        return
+
+    results = [run_in_subprocess(name, args) for name in args.scenario or SCENARIOS]
+    print_results(results)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,365 @@
+# Replays recorded production traffic through CronProcessor, against
+# db.InMemory, FakePlatform and TraceEngine (benchmarks.fakes), up to 100 times
+# faster than it happened, to see how a configuration copes with it.
+#
+# 1. Record the traffic in production with TRAFFIC_LOG_FILE=traffic.jsonl.
+# 2. Turn a time range of it into a trace (users are anonymized):
+#      python -m benchmarks.replay capture traffic.jsonl -o spike.jsonl.gz \
+#          --since 2026-10-13T14:00 --until 2026-10-13T18:00
+# 3. Replay the trace with the settings to try:
+#      python -m benchmarks.replay run spike.jsonl.gz --speed 20 \
+#          --set MAX_PARALLEL_MESSAGES=4 --set COLLECT_CRON_INTERVAL_SEC=60
+#
+# The arrival time of a mention is the time it was posted, read from its X id
+# (or else the time it was claimed). The latencies printed by `run` are in trace
+# time (multiplied back by the speed), next to the ones recorded in production.
+# The intervals, timeouts and TTLs are divided by the speed (rounded to whole
+# seconds, at least 1) and the *_RPM / *_TPM rate limits multiplied by it.
+import argparse
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import os
+import resource
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+
+from benchmarks.fakes import FakePlatform, TraceEngine, percentile
+from benchmarks.processor import FINAL_STATUSES, print_results
+from cron_processor import (
+    DEFAULT_COLLECT_CRON_INTERVAL_SEC,
+    DEFAULT_FAILED_VIDEO_TTL_SEC,
+    DEFAULT_LEASE_SEC,
+    DEFAULT_MESSAGE_DEADLINE_SEC,
+    DEFAULT_PROCESSOR_ACTIVE_INTERVAL_SEC,
+    DEFAULT_PROCESSOR_IDLE_INTERVAL_SEC,
+    DEFAULT_STATUS_FLUSH_INTERVAL_SEC,
+    DEFAULT_TIMESTAMPS_CACHE_TTL_SEC,
+    CronProcessor,
+)
+from db import InMemory
+from metrics import metrics
+from misc import Status
+
+TRACE_VERSION = 1
+# Milliseconds of the X epoch, X ids hold the time they were created at.
+X_EPOCH_MS = 1288834974657
+
+DURATIONS = {
+    "COLLECT_CRON_INTERVAL_SEC": DEFAULT_COLLECT_CRON_INTERVAL_SEC,
+    "PROCESSOR_IDLE_INTERVAL_SEC": DEFAULT_PROCESSOR_IDLE_INTERVAL_SEC,
+    "PROCESSOR_ACTIVE_INTERVAL_SEC": DEFAULT_PROCESSOR_ACTIVE_INTERVAL_SEC,
+    "LEASE_SEC": DEFAULT_LEASE_SEC,
+    "MESSAGE_DEADLINE_SEC": DEFAULT_MESSAGE_DEADLINE_SEC,
+    "STATUS_FLUSH_INTERVAL_SEC": DEFAULT_STATUS_FLUSH_INTERVAL_SEC,
+    "TIMESTAMPS_CACHE_TTL_SEC": DEFAULT_TIMESTAMPS_CACHE_TTL_SEC,
+    "FAILED_VIDEO_TTL_SEC": DEFAULT_FAILED_VIDEO_TTL_SEC,
+}
+RATES = [
+    f"{limiter}_{unit}"
+    for limiter in ("GEMINI", "YOUTUBE", "X_MENTIONS", "X_REPLY")
+    for unit in ("RPM", "TPM")
+]
+
+
+def read_events(paths):
+    for path in paths:
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # a line cut by a crash
+                    continue
+
+
+def arrival_time(msg_id, claimed_at):
+    try:
+        posted_at = ((int(msg_id) >> 22) + X_EPOCH_MS) / 1000
+    except (TypeError, ValueError):
+        return claimed_at
+    # not an X id
+    if not claimed_at - 60 * 60 * 24 <= posted_at <= claimed_at:
+        return claimed_at
+    return posted_at
+
+
+def anonymize(user):
+    return hashlib.sha256(str(user).encode("utf-8")).hexdigest()[:10]
+
+
+def parse_time(value):
+    # an ISO date (local time if no timezone is given) or a unix timestamp
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def capture(paths, since=None, until=None):
+    # Returns the header, the videos and the mentions of the trace.
+    events = sorted(read_events(paths), key=lambda e: e["t"])
+    mentions = {}
+    for e in events:
+        # a message claimed again (expired lease) keeps its first arrival
+        if e["event"] == "mention" and e["msg_id"] not in mentions:
+            arrived_at = arrival_time(e["msg_id"], e["t"])
+            if (since is None or arrived_at >= since) and (
+                until is None or arrived_at < until
+            ):
+                mentions[e["msg_id"]] = dict(
+                    t=arrived_at, user=anonymize(e["user"]), video=e["video"]
+                )
+    if not mentions:
+        raise ValueError("No mention in the traffic log for that time range")
+
+    first_mention = {}
+    for m in sorted(mentions.values(), key=lambda m: m["t"]):
+        if m["video"] is not None:
+            first_mention.setdefault(m["video"], m["t"])
+    # Only the calls made after the first mention of the video count, the ones
+    # made before were for earlier mentions (the timestamps were cached since).
+    calls = {
+        video: dict(fetches=[], llm=[], results=[], transcript=None)
+        for video in first_mention
+    }
+    replies = []
+    for e in events:
+        if e["event"] == "reply" and e["msg_id"] in mentions and e["ok"]:
+            replies.append(e)
+        video = calls.get(e.get("video"))
+        if video is None or e["t"] < first_mention[e["video"]]:
+            continue
+        if e["event"] == "transcript_fetch":
+            video["fetches"].append([e["sec"], e["ok"]])
+        elif e["event"] == "llm_request":
+            video["llm"].append([e["sec"], e["tokens"], e["ok"]])
+        elif e["event"] == "transcript":
+            video["transcript"] = e
+        elif e["event"] == "video":
+            video["results"].append(e["result"])
+
+    videos = []
+    for video_id, video in calls.items():
+        results = video["results"]
+        if not results:
+            # not done when the log was captured: replayed as a typical video
+            continue
+        ran = video["transcript"] or video["fetches"] or video["llm"]
+        if "unavailable" in results:
+            result = "unavailable"
+        elif "ok" in results:
+            result = "ok" if ran else "cached"
+        else:
+            result = "failed"
+        transcript = video["transcript"] or {}
+        videos.append(
+            dict(
+                type="video",
+                id=video_id,
+                result=result,
+                end=transcript.get("end", 0),
+                windows=transcript.get("windows", 0),
+                chars=transcript.get("chars", 0),
+                fetches=video["fetches"],
+                llm=video["llm"],
+            )
+        )
+
+    start = min(m["t"] for m in mentions.values())
+    latencies = [round(r["t"] - mentions[r["msg_id"]]["t"], 3) for r in replies]
+    header = dict(
+        type="header",
+        version=TRACE_VERSION,
+        start=datetime.fromtimestamp(start, timezone.utc).isoformat(),
+        duration_sec=round(max(m["t"] for m in mentions.values()) - start, 3),
+        mentions=len(mentions),
+        videos=len(first_mention),
+        reply_sec=round(statistics.median(r["sec"] for r in replies), 3)
+        if replies
+        else None,
+        recorded=dict(
+            answered=len(latencies),
+            p50_sec=percentile(latencies, 50),
+            p95_sec=percentile(latencies, 95),
+            p99_sec=percentile(latencies, 99),
+        ),
+    )
+    trace_mentions = [
+        dict(type="mention", t=round(m["t"] - start, 3), user=m["user"], video=m["video"])
+        for m in sorted(mentions.values(), key=lambda m: m["t"])
+    ]
+    return header, videos, trace_mentions
+
+
+def write_trace(path, header, videos, mentions):
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        for record in [header, *videos, *mentions]:
+            f.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+
+def read_trace(path):
+    header, videos, mentions = None, {}, []
+    for record in read_events([path]):
+        if record["type"] == "header":
+            if record["version"] != TRACE_VERSION:
+                raise ValueError(f"Unsupported trace version {record['version']}")
+            header = record
+        elif record["type"] == "video":
+            videos[record["id"]] = record
+        elif record["type"] == "mention":
+            mentions.append(record)
+    if header is None:
+        raise ValueError(f"{path} is not a trace")
+    return header, videos, mentions
+
+
+def scaled_env(settings, speed):
+    env = dict(settings)
+    for name, default in DURATIONS.items():
+        value = float(settings.get(name, os.environ.get(name, default)))
+        env[name] = str(max(round(value / speed), 1) if value else 0)
+    for name in RATES:
+        value = settings.get(name, os.environ.get(name))
+        if value:
+            env[name] = str(int(float(value) * speed))
+    return env
+
+
+async def replay(path, speed, settings, timeout):
+    header, videos, mentions = read_trace(path)
+    os.environ.update(scaled_env(settings, speed))
+    db = InMemory()
+    platform = FakePlatform(reply_latency=(header["reply_sec"] or 0.5) / speed)
+    engine = TraceEngine(videos, speed)
+    processor = CronProcessor(db, platform, engine)
+    for video in videos.values():
+        if video["result"] == "cached":
+            await db.add_chapters(video["id"], f"0:00 - Intro of {video['id']}")
+
+    started = time.monotonic()
+    for m in mentions:
+        platform.add_mentions([m["video"]], [m["user"]], started + m["t"] / speed)
+    tasks = [
+        asyncio.create_task(processor.collect_platform_messages()),
+        asyncio.create_task(processor.run_data_processor()),
+    ]
+    if timeout is None:
+        timeout = (header["duration_sec"] * 2 + 60 * 60) / speed
+    deadline = started + timeout
+    peak_backlog = 0
+    while time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+        peak_backlog = max(
+            peak_backlog, metrics.gauges.get(("tsb_backlog_messages", ()), 0)
+        )
+        if len(db.messages) == len(mentions) and all(
+            m.status in FINAL_STATUSES for m in db.messages.values()
+        ):
+            break
+    finished = time.monotonic()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    # in trace time
+    latencies = [
+        (platform.replied_at[msg_id] - platform.arrived_at[msg_id]) * speed
+        for msg_id in platform.replied_at
+    ]
+    statuses = {}
+    for m in db.messages.values():
+        status = Status(m.status).name
+        statuses[status] = statuses.get(status, 0) + 1
+    replying = (max(platform.replied_at.values(), default=finished) - started) * speed
+    return {
+        "scenario": os.path.basename(path).split(".")[0],
+        "speed": speed,
+        "settings": settings,
+        "mentions": len(mentions),
+        "answered": len(latencies),
+        "statuses": statuses,
+        "timed_out": finished >= deadline,
+        "elapsed_sec": round(finished - started, 3),
+        "throughput_per_min": round(len(latencies) / max(replying, 1e-9) * 60, 1),
+        "p50_sec": percentile(latencies, 50),
+        "p95_sec": percentile(latencies, 95),
+        "p99_sec": percentile(latencies, 99),
+        "peak_backlog": peak_backlog,
+        "engine_calls": engine.calls,
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "recorded": header["recorded"],
+    }
+
+
+def fmt(value):
+    return "-" if value is None else f"{value:.1f}"
+
+
+def parse_setting(value):
+    name, sep, setting = value.partition("=")
+    if not sep or not name:
+        raise argparse.ArgumentTypeError(f"expected NAME=VALUE, got {value!r}")
+    return name, setting
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+    capture_parser = commands.add_parser(
+        "capture", help="turn traffic logs (TRAFFIC_LOG_FILE) into a trace"
+    )
+    capture_parser.add_argument("logs", nargs="+")
+    capture_parser.add_argument("-o", "--output", required=True)
+    capture_parser.add_argument("--since", type=parse_time)
+    capture_parser.add_argument("--until", type=parse_time)
+    run_parser = commands.add_parser("run", help="replay a trace")
+    run_parser.add_argument("trace")
+    run_parser.add_argument("--speed", type=float, default=1)
+    run_parser.add_argument(
+        "--set", type=parse_setting, action="append", default=[], metavar="NAME=VALUE"
+    )
+    run_parser.add_argument("--timeout", type=float, help="in seconds of replay")
+    run_parser.add_argument("--json", action="store_true")
+    run_parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    if args.command == "capture":
+        try:
+            header, videos, mentions = capture(args.logs, args.since, args.until)
+        except ValueError as e:
+            parser.error(str(e))
+        write_trace(args.output, header, videos, mentions)
+        print(
+            f"{args.output}: {header['mentions']} mentions of {header['videos']} "
+            f"videos over {header['duration_sec'] / 60:.1f} min from {header['start']}"
+        )
+        return
+
+    if not 0 < args.speed <= 100:
+        parser.error("--speed must be between 0 and 100")
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL)
+    result = asyncio.run(replay(args.trace, args.speed, dict(args.set), args.timeout))
+    if args.json:
+        print(json.dumps(result))
+        return
+    print_results([result])
+    recorded = result["recorded"]
+    print(
+        f"recorded in production: p50 {fmt(recorded['p50_sec'])}s, "
+        f"p95 {fmt(recorded['p95_sec'])}s, p99 {fmt(recorded['p99_sec'])}s; "
+        f"replayed at {args.speed:g}x: p50 {fmt(result['p50_sec'])}s, "
+        f"p95 {fmt(result['p95_sec'])}s, p99 {fmt(result['p99_sec'])}s "
+        f"(latencies in trace time), peak backlog {result['peak_backlog']} messages"
+    )
+    if result["timed_out"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
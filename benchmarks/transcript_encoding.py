@@ -0,0 +1,77 @@
+# Compares the size of the transcript sent to Gemini and the local time spent
+# preparing it, between the old encoding (one pretty-printed JSON object per
+# caption segment, uploaded as a file) and the compact windowed encoding.
+#
+#   python -m benchmarks.transcript_encoding --hours 3
+import argparse
+import json
+import random
+import time
+from datetime import timedelta
+
+from transcript import encode_windows, merge_segments
+
+WORDS = (
+    "so the thing is that we were talking about models and data "
+    "and how people actually use them in practice"
+).split()
+
+# The old path waited this long each time the uploaded file was still processing.
+UPLOAD_POLL_SEC = 10
+
+
+def fake_transcript(hours, seed=0):
+    rnd = random.Random(seed)
+    data, start = [], 0.0
+    while start < hours * 3600:
+        duration = rnd.uniform(1.5, 5.0)
+        text = " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(4, 12)))
+        data.append({"text": text, "start": start, "duration": duration})
+        start += duration
+    return data
+
+
+def legacy_encoding(data):
+    return json.dumps(
+        [
+            {"text": item["text"], "start": str(timedelta(seconds=round(item["start"])))}
+            for item in data
+        ],
+        indent=4,
+    )
+
+
+def measure(encode, data, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        content = encode(data)
+    return content, (time.perf_counter() - started) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hours", type=float, default=3)
+    parser.add_argument("--window-sec", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    data = fake_transcript(args.hours)
+    legacy, legacy_sec = measure(legacy_encoding, data, args.repeat)
+    compact, compact_sec = measure(
+        lambda d: encode_windows(merge_segments(d, args.window_sec)), data, args.repeat
+    )
+
+    print(f"{len(data)} caption segments, {args.hours}h video")
+    print(
+        f"legacy:  {len(legacy.encode()):>10} bytes  encode {legacy_sec * 1000:7.1f} ms"
+        f"  + upload request + {UPLOAD_POLL_SEC}s per processing poll"
+    )
+    print(
+        f"compact: {len(compact.encode()):>10} bytes  encode {compact_sec * 1000:7.1f} ms"
+        f"  inline, no upload"
+    )
+    print(f"size ratio: {len(compact) / len(legacy):.2f}")
+
+
+if __name__ == "__main__":
+    main()
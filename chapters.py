@@ -0,0 +1,88 @@
+import json
+import re
+from typing import List, Optional, Tuple
+
+Chapter = Tuple[int, str]
+
+
+def format_timestamp(seconds: int) -> str:
+    # Same format YouTube uses for chapters: 0:00, 13:03, 1:12:53
+    hours, rest = divmod(int(seconds), 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f"{hours}:{minutes:02}:{seconds:02}"
+    return f"{minutes}:{seconds:02}"
+
+
+def parse_timestamp(value) -> int:
+    if isinstance(value, (int, float)):
+        return int(value)
+    seconds = 0
+    for part in str(value).strip().split(":"):
+        seconds = seconds * 60 + int(float(part))
+    return seconds
+
+
+def format_chapters(chapters: List[Chapter]) -> str:
+    return "\n".join(f"{format_timestamp(start)} - {title}" for start, title in chapters)
+
+
+def parse_chapters(text: str) -> List[Chapter]:
+    # Parses the LLM answer of the form [{"start": 0, "title": "Intro"}, ...].
+    # "start" can be a number of seconds or a HH:MM:SS string.
+    text = text.strip()
+    fenced = re.match(r"^```(?:json)?\s*(.*?)\s*```$", text, re.DOTALL)
+    if fenced:
+        text = fenced.group(1)
+    data = json.loads(text)
+    if isinstance(data, dict):
+        data = data.get("chapters", [])
+    chapters = []
+    for item in data:
+        title = " ".join(str(item["title"]).split())
+        if title:
+            chapters.append((parse_timestamp(item["start"]), title))
+    if not chapters:
+        raise ValueError("No chapters found in the response")
+    return sorted(chapters)
+
+
+def fit_chapters(
+    chapters: List[Chapter], max_length: int, end: Optional[int] = None
+) -> str:
+    # Deterministically shrinks the chapter list until its text fits in max_length:
+    # the two neighbouring chapters that together are the shortest are merged
+    # (keeping the title of the earlier one) until the text is short enough.
+    # `end` is the video length, used for the duration of the last chapter.
+    chapters = sorted(chapters)
+    # Chapters starting after the end of the video are made up. The first one
+    # is kept anyway, it's moved to 0:00.
+    if end:
+        chapters = [c for i, c in enumerate(chapters) if i == 0 or c[0] < end]
+    # Chapters starting at the same second are duplicates.
+    chapters = [
+        c for i, c in enumerate(chapters) if i == 0 or c[0] != chapters[i - 1][0]
+    ]
+    if chapters:
+        chapters[0] = (0, chapters[0][1])
+
+    while len(chapters) > 1 and len(format_chapters(chapters)) > max_length:
+        last_end = end if end and end > chapters[-1][0] else None
+
+        def duration(i):
+            if i + 1 < len(chapters):
+                return chapters[i + 1][0] - chapters[i][0]
+            if last_end is not None:
+                return last_end - chapters[i][0]
+            # Unknown length of the last chapter, assume it's an average one.
+            return chapters[i][0] / i
+
+        shortest = min(
+            range(1, len(chapters)), key=lambda i: duration(i - 1) + duration(i)
+        )
+        del chapters[shortest]
+
+    text = format_chapters(chapters)
+    if len(text) > max_length:
+        text = text[:max_length].rstrip()
+    return text
@@ -1,25 +1,112 @@
 import asyncio
 import os
 import logging
-from typing import List
-from db import BaseDB, Supabase
-from msg_platform import BasePlatform, Twitter
+from typing import Dict, List
+from db import BaseDB
+from msg_platform import BasePlatform
 from dotenv import load_dotenv
 import traceback
 from misc import Status, TSBMessage
+from cache import LRUCache, SingleFlight
+from deadline import DeadlineExceeded
+from metrics import metrics, start_metrics_sink
+from rate_limit import is_rate_limited
+from scheduler import Scheduler
+from status_buffer import StatusBuffer
+from traffic_log import traffic_log
 import re
-from youtube_id_to_timestamps import YoutubeIdToTimestamps
+import socket
+import time
+from datetime import datetime, timedelta, timezone
+from youtube_id_to_timestamps import YoutubeIdToTimestamps, TranscriptUnavailable
 
 DEFAULT_COLLECT_CRON_INTERVAL_SEC = 60 * 15
 DEFAULT_PROCESSOR_IDLE_INTERVAL_SEC = 60 * 5
-DEFAULT_PROCESSOR_ACTIVE_INTERVAL_SEC = 20
+DEFAULT_PROCESSOR_ACTIVE_INTERVAL_SEC = 0
 DEFAULT_MAX_PARALLEL_MESSAGES = 1
+DEFAULT_TIMESTAMPS_CACHE_SIZE = 1024
+DEFAULT_TIMESTAMPS_CACHE_TTL_SEC = 60 * 60 * 24
+DEFAULT_FAILED_VIDEO_TTL_SEC = 60 * 60 * 24
+DEFAULT_FAILED_VIDEOS_CACHE_SIZE = 1024
+DEFAULT_LEASE_SEC = 60 * 30
+DEFAULT_WORK_QUEUE_SIZE = 100
+DEFAULT_CLAIM_BATCH_SIZE = 50
+DEFAULT_LONG_VIDEO_MAX_JOBS = 2
+DEFAULT_MESSAGE_DEADLINE_SEC = 60 * 15
+DEFAULT_STATUS_FLUSH_INTERVAL_SEC = 2
+DEFAULT_STATUS_BATCH_SIZE = 100
+DEFAULT_DB_BACKEND = "supabase"
+
+
+class KnownFailedVideo(Exception):
+    pass
 
 
 class CronProcessor:
-    def __init__(self, db: BaseDB, platform: BasePlatform):
+    def __init__(
+        self, db: BaseDB, platform: BasePlatform, engine: YoutubeIdToTimestamps
+    ):
         self.db = db
         self.platform = platform
+        self.engine = engine
+        self.timestamps_cache = LRUCache(
+            max_size=int(
+                os.environ.get("TIMESTAMPS_CACHE_SIZE", DEFAULT_TIMESTAMPS_CACHE_SIZE)
+            ),
+            ttl=int(
+                os.environ.get(
+                    "TIMESTAMPS_CACHE_TTL_SEC", DEFAULT_TIMESTAMPS_CACHE_TTL_SEC
+                )
+            ),
+        )
+        self.failed_videos_cache = LRUCache(
+            max_size=int(
+                os.environ.get(
+                    "FAILED_VIDEOS_CACHE_SIZE", DEFAULT_FAILED_VIDEOS_CACHE_SIZE
+                )
+            )
+        )
+        self.single_flight = SingleFlight()
+        # Messages inserted by the collector, not yet taken by the processor. The
+        # processor wakes up as soon as something is put here, and the collector
+        # waits when it's full, so it can't run too far ahead of the processor.
+        self.work_queue = asyncio.Queue(
+            maxsize=int(os.environ.get("WORK_QUEUE_SIZE", DEFAULT_WORK_QUEUE_SIZE))
+        )
+        self.worker_id = os.environ.get(
+            "WORKER_ID", f"{socket.gethostname()}-{os.getpid()}"
+        )
+        # Claimed messages waiting for a free slot, grouped by video_id, so all
+        # the messages for a video are answered together.
+        self.backlog = Scheduler()
+        self.backlog_claimed_at = 0
+        # Messages of the videos being processed, by id. Their leases are
+        # renewed until they are done.
+        self.processing: Dict[int, TSBMessage] = {}
+        # Long videos are chaptered in their own pool, so they don't take the
+        # slots of the short ones. long_jobs counts the ones waiting or running.
+        # Only up to twice the pool size of them gets its slot back: the ones
+        # beyond that keep it, so a burst of long videos can't make the
+        # processor start more and more of them.
+        long_video_max_jobs = max(
+            int(os.environ.get("LONG_VIDEO_MAX_JOBS", DEFAULT_LONG_VIDEO_MAX_JOBS)),
+            1,
+        )
+        self.long_video_slots = asyncio.Semaphore(long_video_max_jobs)
+        self.long_jobs_without_slot = long_video_max_jobs * 2
+        self.long_jobs = 0
+        self.slot_freed = asyncio.Event()
+        self.status_buffer = StatusBuffer(
+            db,
+            flush_interval=float(
+                os.environ.get(
+                    "STATUS_FLUSH_INTERVAL_SEC", DEFAULT_STATUS_FLUSH_INTERVAL_SEC
+                )
+            ),
+            max_batch=int(
+                os.environ.get("STATUS_BATCH_SIZE", DEFAULT_STATUS_BATCH_SIZE)
+            ),
+        )
 
     async def collect_platform_messages(self):
         while True:
@@ -34,14 +121,23 @@ class CronProcessor:
             try:
                 latest_db_id = await self.db.get_latest_message_id()
                 logging.debug(f"{latest_db_id=}")
-                messages = await self.platform.gather_messages(
+                # Each page is stored as soon as it's received, but the job run (which
+                # moves latest_db_id forward) only after all the pages are stored, so
+                # a failure in the middle makes the next run fetch the same range again.
+                messages = []
+                async for page in self.platform.iter_messages(
                     since_message_id=latest_db_id
-                )
+                ):
+                    with metrics.span("db_insert_messages"):
+                        inserted = await self.db.insert_messages(
+                            page, record_jobrun=False
+                        )
+                    metrics.inc("tsb_messages_collected_total", len(page))
+                    await self._notify_new_work(inserted)
+                    messages.extend(page)
                 logging.debug(f"{len(messages)=}")
                 if messages:
                     await self.db.insert_jobrun(messages)
-                for msg in messages:
-                    await self.db.insert_message(msg)
                 logging.info("Cron job for collect_platform_messages done!")
             except Exception as e:
                 logging.error(
@@ -50,6 +146,41 @@ class CronProcessor:
             await asyncio.sleep(cron_interval)
 
     async def run_data_processor(self):
+        # The final statuses of the messages are written in the background, and
+        # the leases of the messages being processed are renewed.
+        flusher = asyncio.create_task(self.status_buffer.run())
+        lease_renewer = asyncio.create_task(self._renew_leases())
+        try:
+            await self._run_processor_loop()
+        finally:
+            flusher.cancel()
+            lease_renewer.cancel()
+            await self.status_buffer.flush()
+
+    async def _renew_leases(self):
+        # A video can take longer than LEASE_SEC (long videos, retries), so the
+        # leases of its messages are extended every third of LEASE_SEC while
+        # it's processed. Otherwise another worker (or this one) could claim them
+        # again and answer them twice.
+        while True:
+            lease_sec = int(os.environ.get("LEASE_SEC", DEFAULT_LEASE_SEC))
+            await asyncio.sleep(max(lease_sec / 3, 1))
+            messages = list(self.processing.values())
+            if not messages:
+                continue
+            try:
+                with metrics.span("db_extend_lease"):
+                    await self.db.extend_lease(messages, self.worker_id, lease_sec)
+            except Exception as e:
+                logging.error(
+                    f"Error when extending the leases of {len(messages)} messages. {traceback.format_exc()} {e}"
+                )
+
+    async def _run_processor_loop(self):
+        # Videos are started as soon as a slot is free (and the rate limiters
+        # allow their calls), instead of waiting for a whole batch to finish.
+        # A slot is one video, with all the claimed messages asking for it.
+        in_flight = set()
         while True:
             processor_idle_interval = int(
                 os.environ.get(
@@ -63,34 +194,188 @@ class CronProcessor:
                 )
             )
             max_parallel_messages = int(
-                os.environ.get("MAX_MESSAGES", DEFAULT_MAX_PARALLEL_MESSAGES)
+                os.environ.get(
+                    "MAX_PARALLEL_MESSAGES",
+                    os.environ.get("MAX_MESSAGES", DEFAULT_MAX_PARALLEL_MESSAGES),
+                )
             )
-            messages = await self._get_messages_to_process(max_parallel_messages)
-            if not messages:
+            self.slot_freed.clear()
+            free_slots = max_parallel_messages - (
+                len(in_flight) - min(self.long_jobs, self.long_jobs_without_slot)
+            )
+            metrics.set_gauge("tsb_messages_in_flight", len(in_flight))
+            metrics.set_gauge("tsb_work_queue_depth", self.work_queue.qsize())
+            metrics.set_gauge("tsb_backlog_messages", self.backlog.message_count())
+            claimed = False
+            if free_slots > 0 and not self.backlog:
+                claimed = await self._fill_backlog()
+            released = await self._release_expiring_backlog()
+            groups = self._take_from_backlog(free_slots)
+
+            if groups:
+                for video_id, messages in groups:
+                    in_flight.add(
+                        asyncio.create_task(self._process_video(video_id, messages))
+                    )
+                if processor_active_interval:
+                    await asyncio.sleep(processor_active_interval)
+                continue
+
+            if claimed or released:
+                # Nothing to start from that batch (e.g. only messages without a
+                # video), but there may be more in the db: claim again right away
+                # instead of waiting. Only an empty claim means there's no work.
+                continue
+
+            if not in_flight:
                 logging.info(
-                    f"No message to be processed found in the db. Will wait {processor_idle_interval} seconds."
+                    f"No message to be processed found in the db. Will wait {processor_idle_interval} seconds or until new messages are collected."
                 )
-                await asyncio.sleep(processor_idle_interval)
+                await self._wait_for_new_work(processor_idle_interval)
                 logging.info(
                     f"Processing data with interval {processor_idle_interval} seconds..."
                 )
                 continue
 
-            tasks = [self._process_message(msg) for msg in messages]
-            await asyncio.gather(*tasks)
-            await asyncio.sleep(processor_active_interval)
+            # Wait for a video to finish or to move to the long videos pool, or
+            # for new work if there are free slots.
+            slot_freed = asyncio.create_task(self.slot_freed.wait())
+            waiters = {*in_flight, slot_freed}
+            new_work = None
+            if free_slots > 0:
+                new_work = asyncio.create_task(
+                    self._wait_for_new_work(processor_idle_interval)
+                )
+                waiters.add(new_work)
+            done, _ = await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+            if new_work is not None and not new_work.done():
+                new_work.cancel()
+            if not slot_freed.done():
+                slot_freed.cancel()
+            for task in done & in_flight:
+                if task.exception():
+                    logging.error(f"Error when processing a video. {task.exception()}")
+            in_flight -= done
+
+    async def _notify_new_work(self, count: int):
+        # One token per message actually inserted: the duplicates (already in
+        # the db) don't wake up the processor.
+        if self.work_queue.full():
+            logging.info("The processor is behind, waiting before collecting more.")
+        for _ in range(count):
+            await self.work_queue.put(None)
+
+    def _on_db_new_message(self, payload=None):
+        # Inserts made by other processes (or from the web UI), only used to wake
+        # up the processor, so there's no need to queue more than one of them.
+        if self.work_queue.empty():
+            self.work_queue.put_nowait(None)
+
+    async def _wait_for_new_work(self, timeout: int):
+        # The db is still polled every `timeout` seconds in case a notification
+        # is missed (e.g. a record updated manually to be reprocessed).
+        try:
+            await asyncio.wait_for(self.work_queue.get(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def _mark_work_taken(self, count: int):
+        for _ in range(min(count, self.work_queue.qsize())):
+            self.work_queue.get_nowait()
+
+    async def _fill_backlog(self) -> bool:
+        # Returns whether the claim found messages.
+        claim_batch_size = int(
+            os.environ.get("CLAIM_BATCH_SIZE", DEFAULT_CLAIM_BATCH_SIZE)
+        )
+        # The tokens queued before the claim are all stale if it finds nothing
+        # (e.g. another worker took those messages), so they are dropped instead
+        # of each one triggering an empty claim.
+        queued = self.work_queue.qsize()
+        # before the claim, so the lease is never thought to last longer than it does
+        claimed_at = time.monotonic()
+        messages = await self._get_messages_to_process(claim_batch_size)
+        if not messages:
+            self._mark_work_taken(queued)
+            return False
+        self._mark_work_taken(len(messages))
+        # A message being processed here can only be claimed again if its lease
+        # couldn't be renewed. It's already being answered.
+        messages = [msg for msg in messages if msg.id not in self.processing]
+        video_ids = await self._get_video_ids(messages)
+        self.backlog_claimed_at = claimed_at
+        for msg, video_id in zip(messages, video_ids):
+            traffic_log.record(
+                "mention", msg_id=msg.msg_id, user=msg.msg_from, video=video_id
+            )
+            if not video_id:
+                self._set_status(msg, Status.invalid)
+                continue
+            self.backlog.add(video_id, msg)
+        return True
+
+    async def _release_expiring_backlog(self) -> bool:
+        # A video is only started if the lease of its messages lasts long enough
+        # for it to be renewed while it's processed: the deadline of the video,
+        # or half the lease if that's shorter. Otherwise the backlog is given
+        # back (its lease ends now), so it's claimed again with a new lease.
+        # Returns whether the backlog was released.
+        if not self.backlog:
+            return False
+        lease_sec = int(os.environ.get("LEASE_SEC", DEFAULT_LEASE_SEC))
+        deadline_sec = int(
+            os.environ.get("MESSAGE_DEADLINE_SEC", DEFAULT_MESSAGE_DEADLINE_SEC)
+        )
+        lease_left = self.backlog_claimed_at + lease_sec - time.monotonic()
+        if lease_left >= min(deadline_sec, lease_sec / 2):
+            return False
+        messages = [msg for msgs in self.backlog.videos.values() for msg in msgs]
+        logging.warning(
+            f"The lease of {len(messages)} claimed messages is about to expire before they were started, releasing them."
+        )
+        self.backlog.clear()
+        try:
+            await self.db.extend_lease(messages, self.worker_id, 0)
+        except Exception as e:
+            logging.error(
+                f"Error when releasing {len(messages)} messages. {traceback.format_exc()} {e}"
+            )
+        return True
+
+    def _take_from_backlog(self, free_slots: int) -> List:
+        # The videos with cached timestamps (or known to fail) only need the
+        # replies, so they don't wait for a slot.
+        groups = self.backlog.take_ready(
+            lambda video_id: video_id in self.timestamps_cache
+            or video_id in self.failed_videos_cache
+        )
+        if free_slots > 0:
+            groups.extend(self.backlog.take(free_slots))
+        return groups
 
     async def _get_messages_to_process(self, limit: int) -> List:
+        lease_sec = int(os.environ.get("LEASE_SEC", DEFAULT_LEASE_SEC))
         try:
-            return await self.db.get_messages_to_process(limit)
+            with metrics.span("db_claim"):
+                return await self.db.claim_messages(limit, self.worker_id, lease_sec)
         except Exception as e:
             logging.error(
                 f"Error getting messages to process: {traceback.format_exc()} {e}"
             )
             return []
 
-    def _get_video_id(self, text):
-        youtube_url = self.platform.get_original_url(text)
+    async def _get_video_ids(self, messages: List[TSBMessage]) -> List:
+        # The links of all the messages are resolved concurrently.
+        texts = [msg.msg_text for msg in messages]
+        try:
+            with metrics.span("url_resolve"):
+                urls = await self.platform.get_original_urls(texts)
+        except Exception as e:
+            logging.error(f"Error when resolving urls. {traceback.format_exc()} {e}")
+            urls = texts
+        return [self._get_video_id(url) for url in urls]
+
+    def _get_video_id(self, youtube_url):
         pattern = r"https?:\/\/(?:www\.)?(?:youtube\.com\/(?:watch\?(?:[^=&]*=[^=&]*&)*v=|embed\/|v\/|live\/)|youtu\.be\/)([0-9A-Za-z_-]{11})"
         match = re.search(pattern, youtube_url)
         if match:
@@ -98,74 +383,247 @@ class CronProcessor:
         else:
             return None
 
-    async def _process_message(self, msg: TSBMessage):
-        try:
-            await self.db.update(msg, Status.process_start)
-        except Exception as e:
-            logging.error(
-                f"Error when updating to Processed. {msg.id=}. {traceback.format_exc()} {e}"
-            )
+    async def _get_timestamps(self, video_id):
+        timestamps = self.timestamps_cache.get(video_id)
+        if timestamps is not None:
+            metrics.inc("tsb_cache_requests_total", cache="timestamps", result="hit")
+            return timestamps
+        metrics.inc("tsb_cache_requests_total", cache="timestamps", result="miss")
+        if video_id in self.single_flight:
+            metrics.inc("tsb_cache_requests_total", cache="single_flight", result="hit")
+        # When a video is trending, many messages for it arrive in the same batch.
+        # Only the first one computes the timestamps, the others wait for its result.
+        return await self.single_flight.do(
+            video_id, lambda: self._get_or_create_timestamps(video_id)
+        )
 
-        video_id = self._get_video_id(msg.msg_text)
-        if not video_id:
-            try:
-                await self.db.update(msg, Status.invalid)
-            except Exception as e:
-                logging.error(
-                    f"Error when updating to Invalid. {msg.id=}. {traceback.format_exc()} {e}"
+    async def _get_or_create_timestamps(self, video_id):
+        # The FailedVideo table is only queried when there are no timestamps, so
+        # a video that was already chaptered costs one query.
+        with metrics.span("cache_lookup"):
+            timestamps = None
+            reason = self.failed_videos_cache.get(video_id)
+            if reason is None:
+                timestamps = await self.db.get_timestamps(video_id=video_id)
+                if timestamps is None:
+                    reason = await self.db.get_failed_video(video_id)
+            if reason is not None:
+                metrics.inc(
+                    "tsb_cache_requests_total", cache="failed_videos", result="hit"
                 )
-            finally:
-                return
+                raise KnownFailedVideo(f"{video_id=} is known to fail: {reason}")
 
-        timestamps = await self.db.get_timestamps(video_id=video_id)
-        if timestamps is None:
+        if timestamps is not None:
+            metrics.inc("tsb_cache_requests_total", cache="db", result="hit")
+        else:
+            metrics.inc("tsb_cache_requests_total", cache="db", result="miss")
             try:
-                instance = YoutubeIdToTimestamps(
-                    self.platform.get_max_response_length()
-                )
-                timestamps = instance.get_timestamps(video_id)
+                with metrics.span("get_timestamps"):
+                    timestamps = await self._create_timestamps(video_id)
+            except TranscriptUnavailable as e:
+                await self._add_failed_video(video_id, str(e))
+                raise
+            try:
+                with metrics.span("db_add_chapters"):
+                    await self.db.add_chapters(video_id, timestamps)
             except Exception as e:
                 logging.error(
-                    f"Error when calling get_timestamps. {video_id=}. {traceback.format_exc()} {e}"
+                    f"Error when calling add_chapters. {video_id=}. {timestamps=}. {traceback.format_exc()} {e}"
                 )
-                try:
-                    await self.db.update(msg, Status.failed_timestamps)
-                except Exception as e:
-                    logging.error(
-                        f"Error when updating to failed_timestamps. {msg.id=}. {traceback.format_exc()} {e}"
-                    )
-                finally:
-                    return
+        self.timestamps_cache.set(video_id, timestamps)
+        return timestamps
+
+    async def _create_timestamps(self, video_id):
+        # The engine gets the deadline to size its timeouts and retries. The slot
+        # is also given back at the deadline if a call still hangs (the executor
+        # thread finishes on its own later).
+        deadline_sec = int(
+            os.environ.get("MESSAGE_DEADLINE_SEC", DEFAULT_MESSAGE_DEADLINE_SEC)
+        )
+        started = time.monotonic()
+        windows, end = await self._within_deadline(
+            video_id,
+            deadline_sec,
+            started,
+            lambda deadline: self.engine.get_transcript_async(video_id, deadline),
+        )
+        if not self.engine.is_long_video(end):
+            return await self._within_deadline(
+                video_id,
+                deadline_sec,
+                started,
+                lambda deadline: self.engine.get_chapters_async(
+                    video_id, windows, end, deadline
+                ),
+            )
 
+        # The slot of this video is given back while it waits for (and runs in)
+        # the long videos pool. The wait doesn't count in its deadline.
+        self.long_jobs += 1
+        self.slot_freed.set()
+        try:
+            waiting_since = time.monotonic()
+            with metrics.span("long_video_wait"):
+                await self.long_video_slots.acquire()
+            started += time.monotonic() - waiting_since
             try:
-                await self.db.add_chapters(video_id, timestamps)
-            except Exception as e:
-                logging.error(
-                    f"Error when calling add_chapters. {video_id=}. {timestamps=}. {traceback.format_exc()} {e}"
+                return await self._within_deadline(
+                    video_id,
+                    deadline_sec,
+                    started,
+                    lambda deadline: self.engine.get_chapters_async(
+                        video_id, windows, end, deadline
+                    ),
                 )
+            finally:
+                self.long_video_slots.release()
+        finally:
+            self.long_jobs -= 1
+
+    async def _within_deadline(self, video_id, deadline_sec, started, call):
+        # Runs call(deadline) with what's left of the deadline_sec budget that
+        # started at started (time.monotonic()).
+        if not deadline_sec:
+            return await call(None)
+        left = started + deadline_sec - time.monotonic()
+        try:
+            return await asyncio.wait_for(call(time.time() + left), max(left, 0))
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(f"{video_id=} took more than {deadline_sec}s")
 
+    async def _add_failed_video(self, video_id, reason):
+        ttl = int(os.environ.get("FAILED_VIDEO_TTL_SEC", DEFAULT_FAILED_VIDEO_TTL_SEC))
+        self.failed_videos_cache.set(video_id, reason, ttl=ttl)
         try:
-            await self.db.update(msg, Status.process_end)
+            await self.db.add_failed_video(
+                video_id,
+                reason,
+                datetime.now(timezone.utc) + timedelta(seconds=ttl),
+            )
         except Exception as e:
             logging.error(
-                f"Error when updating to Processed. {msg.id=}. {traceback.format_exc()} {e}"
+                f"Error when calling add_failed_video. {video_id=}. {reason=}. {traceback.format_exc()} {e}"
             )
 
+    async def _process_video(self, video_id: str, messages: List[TSBMessage]):
+        for msg in messages:
+            self.processing[msg.id] = msg
         try:
-            await self.platform.reply(timestamps, msg.msg_id)
-            await self.db.update(msg, Status.answered)
+            await self._answer_video(video_id, messages)
+        finally:
+            for msg in messages:
+                self.processing.pop(msg.id, None)
+
+    async def _answer_video(self, video_id: str, messages: List[TSBMessage]):
+        # The timestamps are computed (or fetched) once, then all the messages
+        # for the video are answered concurrently. The messages were already set
+        # to process_start when they were claimed.
+        try:
+            timestamps = await self._get_timestamps(video_id)
+        except KnownFailedVideo as e:
+            logging.info(f"Skipping {len(messages)} messages. {e}")
+            traffic_log.record("video", video=video_id, result="unavailable")
+            self._set_statuses(messages, Status.failed_timestamps)
+            return
+        except Exception as e:
+            logging.error(
+                f"Error when calling get_timestamps. {video_id=}. {traceback.format_exc()} {e}"
+            )
+            unavailable = isinstance(e, TranscriptUnavailable)
+            traffic_log.record(
+                "video",
+                video=video_id,
+                result="unavailable" if unavailable else "failed",
+            )
+            self._set_statuses(messages, Status.failed_timestamps)
+            return
+        traffic_log.record("video", video=video_id, result="ok")
+
+        # Written right away, not through the status buffer: a message in
+        # process_end is never claimed again, so a crash between the reply and
+        # the write of answered can't lead to a second reply.
+        try:
+            await self.db.update_many(messages, Status.process_end)
+            metrics.inc(
+                "tsb_messages_total", len(messages), status=Status.process_end.name
+            )
         except Exception as e:
             logging.error(
-                f"Error when replying or when updating to Answered. {msg.id=}, {timestamps=}, {traceback.format_exc()} {e}"
+                f"Error when updating to Processed. {[msg.id for msg in messages]=}. {traceback.format_exc()} {e}"
             )
 
-        logging.info("Data processed!")
+        # The X rate limiter (in platform.reply) decides how many go out at once.
+        await asyncio.gather(*(self._reply(msg, timestamps) for msg in messages))
+        logging.info(f"Data processed! {video_id=}, {len(messages)} messages")
+
+    async def _reply(self, msg: TSBMessage, timestamps: str):
+        try:
+            with metrics.span("reply"), traffic_log.timed("reply", msg_id=msg.msg_id):
+                await self.platform.reply(timestamps, msg.msg_id)
+            self._set_status(msg, Status.answered)
+        except Exception as e:
+            logging.error(
+                f"Error when replying. {msg.id=}, {timestamps=}, {traceback.format_exc()} {e}"
+            )
+            # A rejected reply (429) certainly wasn't posted: the message is
+            # claimed again and its reply waits for the pause of the limiter.
+            # Any other error may come after the reply was posted, so it's only
+            # marked, to be checked (and set back to empty) by hand.
+            if is_rate_limited(e):
+                self._set_status(msg, Status.empty)
+            else:
+                self._set_status(msg, Status.failed_reply)
+
+    def _set_status(self, msg: TSBMessage, status: Status):
+        self.status_buffer.set(msg, status)
+        metrics.inc("tsb_messages_total", status=status.name)
+
+    def _set_statuses(self, messages: List[TSBMessage], status: Status):
+        for msg in messages:
+            self._set_status(msg, status)
+
+
+async def create_db() -> BaseDB:
+    # Only the backend in use is imported.
+    backend = os.environ.get("DB_BACKEND", DEFAULT_DB_BACKEND)
+    if backend == "sqlite":
+        from db import SQLite
+
+        return await SQLite.create()
+    if backend == "memory":
+        from db import InMemory
+
+        return InMemory()
+    from db import Supabase
+
+    return await Supabase.create()
+
+
+async def preload_engine(engine: YoutubeIdToTimestamps):
+    try:
+        with metrics.span("engine_preload"):
+            await asyncio.to_thread(engine.preload)
+    except Exception as e:
+        logging.error(f"Error when preloading the engine. {traceback.format_exc()} {e}")
 
 
 async def main():
-    db = await Supabase.create()
+    from msg_platform import Twitter
+
+    start_metrics_sink()
+    db = await create_db()
     platform = Twitter()
-    cron_processor = CronProcessor(db, platform)
+    engine = YoutubeIdToTimestamps(platform.get_max_response_length())
+    cron_processor = CronProcessor(db, platform, engine)
+    # The Gemini and YouTube SDKs are imported in the background while the
+    # collector does its first poll.
+    preload = asyncio.create_task(preload_engine(engine))
+    try:
+        await db.subscribe_new_messages(cron_processor._on_db_new_message)
+    except Exception as e:
+        logging.error(
+            f"Error when subscribing to new messages. {traceback.format_exc()} {e}"
+        )
 
     # I want 2 methods here and not just to pass the result of collect_platform_messages to run_data_processor.
     # The reason is that I want the db to always reflect the current state because I'll make updates directly
@@ -1,4 +1,15 @@
+import importlib
+
 from .base_db import BaseDB
-from .supabase import Supabase
 
-__all__ = ["BaseDB", "Supabase"]
+# The backends are imported on first access (PEP 562), so only the SDK of the
+# backend in use is loaded (supabase alone takes ~0.5s to import).
+_BACKENDS = {"Supabase": ".supabase", "SQLite": ".sqlite", "InMemory": ".memory"}
+
+__all__ = ["BaseDB", "Supabase", "SQLite", "InMemory"]
+
+
+def __getattr__(name):
+    if name in _BACKENDS:
+        return getattr(importlib.import_module(_BACKENDS[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
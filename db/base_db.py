@@ -1,5 +1,6 @@
 from abc import ABC, abstractmethod
-from typing import List, Optional, Dict
+from datetime import datetime
+from typing import Callable, List, Optional, Dict
 from misc import TSBMessage, Status
 
 
@@ -20,12 +21,44 @@ class BaseDB(ABC):
         # inserts a platform message in the db
         pass
 
+    @abstractmethod
+    async def insert_messages(
+        self, messages: List[TSBMessage], record_jobrun: bool = True
+    ) -> int:
+        # inserts a batch of platform messages in the db, ignoring the ones that
+        # already exist (same msg_id), and then inserts the job run infos (unless
+        # record_jobrun is False, for when a job run is stored in several batches).
+        # The job run is written only after all the messages are stored, so the
+        # newest message id never moves past messages that weren't saved.
+        # Returns how many messages were actually inserted.
+        pass
+
     @abstractmethod
     async def get_messages_to_process(self, limit: Optional[int]) -> List[TSBMessage]:
         # gets latest messages that can be processed,
         # meaning the oldest message with status empty.
         pass
 
+    @abstractmethod
+    async def claim_messages(
+        self, limit: Optional[int], worker_id: str, lease_sec: int
+    ) -> List[TSBMessage]:
+        # atomically takes the oldest messages that can be processed, meaning the ones
+        # with status empty or the ones with status process_start whose lease expired
+        # (the worker that took them crashed), sets them to process_start with a lease
+        # of lease_sec seconds for worker_id and returns them.
+        # A message is never returned to two workers while its lease is valid.
+        pass
+
+    @abstractmethod
+    async def extend_lease(
+        self, messages: List[TSBMessage], worker_id: str, lease_sec: int
+    ) -> None:
+        # sets the lease of the messages that are still in process_start and claimed
+        # by worker_id to end lease_sec seconds from now. The messages being
+        # processed are renewed this way, and a lease_sec of 0 gives them back.
+        pass
+
     @abstractmethod
     async def get_timestamps(self, video_id: str) -> Optional[str]:
         # gets the timestamps (actual video process output) text
@@ -36,7 +69,31 @@ class BaseDB(ABC):
         # updates the message with a Status
         pass
 
+    @abstractmethod
+    async def update_many(self, messages: List[TSBMessage], status: Status) -> None:
+        # updates all the messages with the same Status, in one query
+        pass
+
     @abstractmethod
     async def add_chapters(self, video_id: str, timestamps: str) -> None:
         # adds the timestamps for a given video_id
         pass
+
+    @abstractmethod
+    async def get_failed_video(self, video_id: str) -> Optional[str]:
+        # gets the reason why the timestamps couldn't be generated for a video,
+        # or None if it didn't fail or if the failure expired
+        pass
+
+    @abstractmethod
+    async def add_failed_video(
+        self, video_id: str, reason: str, expires_at: datetime
+    ) -> None:
+        # remembers that the timestamps can't be generated for a video until expires_at
+        pass
+
+    async def subscribe_new_messages(self, callback: Callable) -> bool:
+        # calls callback whenever a message is inserted in the db (by any process).
+        # Optional: returns False if the db can't notify about new messages,
+        # in which case the processor only relies on polling.
+        return False
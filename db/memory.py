@@ -0,0 +1,156 @@
+from . import BaseDB
+from dataclasses import replace
+from datetime import datetime
+from typing import Optional, List, Dict
+from misc import TSBMessage, Status
+import logging
+import time
+
+
+class InMemory(BaseDB):
+    # Everything is kept in dicts, nothing survives a restart. Meant for tests and
+    # benchmarks, where it measures the processor's own overhead. Every method
+    # runs without awaiting anything, so each one is atomic within the event loop.
+    def __init__(self):
+        self.messages: Dict[int, TSBMessage] = {}
+        # ids of the messages with status empty or process_start, in id order,
+        # so claiming doesn't scan the messages that are already done
+        self.pending: Dict[int, None] = {}
+        self.msg_ids = set()
+        self.leases: Dict[int, float] = {}
+        self.workers: Dict[int, str] = {}
+        self.jobruns: List[Dict] = []
+        self.chapters: Dict[str, str] = {}
+        self.failed_videos: Dict[str, tuple] = {}
+        self._next_id = 1
+
+    async def get_latest_message_id(self) -> Optional[str]:
+        logging.debug("get_latest_message_id")
+        for jobrun in reversed(self.jobruns):
+            if jobrun["newest_msg_id"] is not None:
+                return jobrun["newest_msg_id"]
+        return None
+
+    async def insert_jobrun(self, messages: List[TSBMessage]) -> None:
+        logging.debug("insert_jobrun")
+        newest_msg_id = max([int(z.msg_id) for z in messages], default=None)
+        self.jobruns.append(
+            {"nr_msgs_found": len(messages), "newest_msg_id": newest_msg_id}
+        )
+
+    async def insert_message(self, message: TSBMessage) -> None:
+        logging.debug("insert_message")
+        if message.msg_id in self.msg_ids:
+            raise ValueError(f"Duplicate msg_id {message.msg_id}")
+        self._insert(message)
+
+    def _insert(self, message: TSBMessage) -> None:
+        message = replace(message, id=self._next_id)
+        self._next_id += 1
+        self.messages[message.id] = message
+        self.msg_ids.add(message.msg_id)
+        self._update_pending(message)
+
+    def _update_pending(self, message: TSBMessage) -> None:
+        if message.status in (Status.empty.value, Status.process_start.value):
+            if message.id not in self.pending:
+                # only a message set back to empty can be out of order
+                out_of_order = self.pending and message.id < next(reversed(self.pending))
+                self.pending[message.id] = None
+                if out_of_order:
+                    self.pending = dict.fromkeys(sorted(self.pending))
+        else:
+            self.pending.pop(message.id, None)
+
+    async def insert_messages(
+        self, messages: List[TSBMessage], record_jobrun: bool = True
+    ) -> int:
+        logging.debug("insert_messages")
+        if not messages:
+            return 0
+        inserted = 0
+        for message in messages:
+            if message.msg_id not in self.msg_ids:
+                self._insert(message)
+                inserted += 1
+        if record_jobrun:
+            await self.insert_jobrun(messages)
+        return inserted
+
+    async def get_messages_to_process(self, limit: Optional[int]) -> List[TSBMessage]:
+        logging.debug("get_messages_to_process")
+        messages = [
+            replace(self.messages[i])
+            for i in self.pending
+            if self.messages[i].status == Status.empty.value
+        ]
+        return messages[:limit] if limit else messages
+
+    def _is_claimable(self, message: TSBMessage, now: float) -> bool:
+        if message.status == Status.empty.value:
+            return True
+        return (
+            message.status == Status.process_start.value
+            and self.leases.get(message.id, now) < now
+        )
+
+    async def claim_messages(
+        self, limit: Optional[int], worker_id: str, lease_sec: int
+    ) -> List[TSBMessage]:
+        logging.debug("claim_messages")
+        now = time.time()
+        claimed = []
+        for i in self.pending:
+            if limit and len(claimed) >= limit:
+                break
+            message = self.messages[i]
+            if self._is_claimable(message, now):
+                message.status = Status.process_start.value
+                self.leases[message.id] = now + lease_sec
+                self.workers[message.id] = worker_id
+                claimed.append(replace(message))
+        return claimed
+
+    async def extend_lease(
+        self, messages: List[TSBMessage], worker_id: str, lease_sec: int
+    ) -> None:
+        logging.debug("extend_lease")
+        now = time.time()
+        for message in messages:
+            stored = self.messages.get(message.id)
+            if (
+                stored is not None
+                and stored.status == Status.process_start.value
+                and self.workers.get(message.id) == worker_id
+            ):
+                self.leases[message.id] = now + lease_sec
+
+    async def get_timestamps(self, video_id: str) -> Optional[str]:
+        logging.debug("get_timestamps")
+        return self.chapters.get(video_id)
+
+    async def update(self, message: TSBMessage, status: Status) -> None:
+        logging.debug("update")
+        if message.id in self.messages:
+            self.messages[message.id].status = status.value
+            self._update_pending(self.messages[message.id])
+
+    async def update_many(self, messages: List[TSBMessage], status: Status) -> None:
+        logging.debug("update_many")
+        for message in messages:
+            await self.update(message, status)
+
+    async def add_chapters(self, video_id: str, timestamps: str) -> None:
+        logging.debug("add_chapters")
+        self.chapters.setdefault(video_id, timestamps)
+
+    async def get_failed_video(self, video_id: str) -> Optional[str]:
+        logging.debug("get_failed_video")
+        reason, expires_at = self.failed_videos.get(video_id, (None, 0))
+        return reason if expires_at > time.time() else None
+
+    async def add_failed_video(
+        self, video_id: str, reason: str, expires_at: datetime
+    ) -> None:
+        logging.debug("add_failed_video")
+        self.failed_videos[video_id] = (reason, expires_at.timestamp())
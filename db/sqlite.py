@@ -0,0 +1,217 @@
+from . import BaseDB
+from datetime import datetime
+from typing import Optional, List, Dict
+from misc import TSBMessage, Status
+import os
+import logging
+import sqlite3
+import time
+
+DEFAULT_SQLITE_PATH = "timestampbuddy.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS TSBMessage (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    status INTEGER NOT NULL DEFAULT 0,
+    msg_text TEXT,
+    msg_from TEXT,
+    msg_id TEXT NOT NULL UNIQUE,
+    worker_id TEXT,
+    lease_expires_at REAL
+);
+CREATE INDEX IF NOT EXISTS TSBMessage_status ON TSBMessage (status, id);
+CREATE TABLE IF NOT EXISTS JobRun (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    nr_msgs_found INTEGER,
+    newest_msg_id TEXT
+);
+CREATE TABLE IF NOT EXISTS Chapter (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    video_id TEXT NOT NULL,
+    timestamps TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS Chapter_video_id ON Chapter (video_id);
+CREATE TABLE IF NOT EXISTS FailedVideo (
+    video_id TEXT PRIMARY KEY,
+    reason TEXT,
+    expires_at REAL NOT NULL
+);
+"""
+
+CLAIMABLE = "status = ? OR (status = ? AND lease_expires_at < ?)"
+
+
+class SQLite(BaseDB):
+    # Local db for small deployments and for benchmarks without network noise.
+    # Same tables as in Supabase. The queries run directly on the event loop:
+    # they are local and take microseconds, less than handing them to a thread.
+    # Several processes can share the file (WAL mode), claims are done in a
+    # write transaction so they stay atomic across processes.
+    def __init__(self, connection: sqlite3.Connection):
+        self.connection = connection
+        self.connection.row_factory = sqlite3.Row
+
+    @classmethod
+    async def create(cls, path: Optional[str] = None):
+        path = path or os.environ.get("SQLITE_PATH", DEFAULT_SQLITE_PATH)
+        connection = sqlite3.connect(path, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("PRAGMA busy_timeout=5000")
+        connection.executescript(SCHEMA)
+        return cls(connection)
+
+    def _to_message(self, row: sqlite3.Row) -> TSBMessage:
+        return TSBMessage(
+            id=row["id"],
+            status=row["status"],
+            msg_text=row["msg_text"],
+            msg_from=row["msg_from"],
+            msg_id=row["msg_id"],
+        )
+
+    async def get_latest_message_id(self) -> Optional[str]:
+        logging.debug("get_latest_message_id")
+        row = self.connection.execute(
+            "SELECT newest_msg_id FROM JobRun WHERE newest_msg_id IS NOT NULL "
+            "ORDER BY id DESC LIMIT 1"
+        ).fetchone()
+        return row["newest_msg_id"] if row else None
+
+    async def insert_jobrun(self, messages: List[TSBMessage]) -> None:
+        logging.debug("insert_jobrun")
+        newest_msg_id = max([int(z.msg_id) for z in messages], default=None)
+        self.connection.execute(
+            "INSERT INTO JobRun (nr_msgs_found, newest_msg_id) VALUES (?, ?)",
+            (len(messages), None if newest_msg_id is None else str(newest_msg_id)),
+        )
+
+    async def insert_message(self, message: TSBMessage) -> None:
+        logging.debug("insert_message")
+        self.connection.execute(
+            "INSERT INTO TSBMessage (status, msg_text, msg_from, msg_id) "
+            "VALUES (?, ?, ?, ?)",
+            (message.status, message.msg_text, message.msg_from, str(message.msg_id)),
+        )
+
+    async def insert_messages(
+        self, messages: List[TSBMessage], record_jobrun: bool = True
+    ) -> int:
+        logging.debug("insert_messages")
+        if not messages:
+            return 0
+        with self.connection:
+            self.connection.execute("BEGIN")
+            cursor = self.connection.executemany(
+                "INSERT OR IGNORE INTO TSBMessage (status, msg_text, msg_from, msg_id) "
+                "VALUES (?, ?, ?, ?)",
+                [(m.status, m.msg_text, m.msg_from, str(m.msg_id)) for m in messages],
+            )
+            # Unlike Supabase, the job run is in the same transaction.
+            if record_jobrun:
+                await self.insert_jobrun(messages)
+        # the ignored duplicates aren't counted
+        return cursor.rowcount
+
+    async def get_messages_to_process(self, limit: Optional[int]) -> List[TSBMessage]:
+        logging.debug("get_messages_to_process")
+        rows = self.connection.execute(
+            "SELECT * FROM TSBMessage WHERE status = ? ORDER BY id LIMIT ?",
+            (Status.empty.value, limit or -1),
+        ).fetchall()
+        return [self._to_message(row) for row in rows]
+
+    async def claim_messages(
+        self, limit: Optional[int], worker_id: str, lease_sec: int
+    ) -> List[TSBMessage]:
+        logging.debug("claim_messages")
+        now = time.time()
+        claimable = (Status.empty.value, Status.process_start.value, now)
+        with self.connection:
+            # IMMEDIATE takes the write lock right away, so no other process
+            # can claim the same rows between the select and the update.
+            self.connection.execute("BEGIN IMMEDIATE")
+            rows = self.connection.execute(
+                f"SELECT * FROM TSBMessage WHERE {CLAIMABLE} ORDER BY id LIMIT ?",
+                (*claimable, limit or -1),
+            ).fetchall()
+            if not rows:
+                return []
+            ids = [row["id"] for row in rows]
+            self.connection.execute(
+                "UPDATE TSBMessage SET status = ?, worker_id = ?, lease_expires_at = ? "
+                f"WHERE id IN ({','.join('?' * len(ids))})",
+                (Status.process_start.value, worker_id, now + lease_sec, *ids),
+            )
+        messages = [self._to_message(row) for row in rows]
+        for message in messages:
+            message.status = Status.process_start.value
+        return messages
+
+    async def extend_lease(
+        self, messages: List[TSBMessage], worker_id: str, lease_sec: int
+    ) -> None:
+        logging.debug("extend_lease")
+        if not messages:
+            return
+        self.connection.execute(
+            "UPDATE TSBMessage SET lease_expires_at = ? WHERE status = ? "
+            f"AND worker_id = ? AND id IN ({','.join('?' * len(messages))})",
+            (
+                time.time() + lease_sec,
+                Status.process_start.value,
+                worker_id,
+                *(m.id for m in messages),
+            ),
+        )
+
+    async def get_timestamps(self, video_id: str) -> Optional[str]:
+        logging.debug("get_timestamps")
+        row = self.connection.execute(
+            "SELECT timestamps FROM Chapter WHERE video_id = ? LIMIT 1", (video_id,)
+        ).fetchone()
+        return row["timestamps"] if row else None
+
+    async def update(self, message: TSBMessage, status: Status) -> None:
+        logging.debug("update")
+        self.connection.execute(
+            "UPDATE TSBMessage SET status = ? WHERE id = ?", (status.value, message.id)
+        )
+
+    async def update_many(self, messages: List[TSBMessage], status: Status) -> None:
+        logging.debug("update_many")
+        if not messages:
+            return
+        self.connection.execute(
+            "UPDATE TSBMessage SET status = ? "
+            f"WHERE id IN ({','.join('?' * len(messages))})",
+            (status.value, *(m.id for m in messages)),
+        )
+
+    async def add_chapters(self, video_id: str, timestamps: str) -> None:
+        logging.debug("add_chapters")
+        self.connection.execute(
+            "INSERT INTO Chapter (video_id, timestamps) VALUES (?, ?)",
+            (video_id, timestamps),
+        )
+
+    async def get_failed_video(self, video_id: str) -> Optional[str]:
+        logging.debug("get_failed_video")
+        row = self.connection.execute(
+            "SELECT reason FROM FailedVideo WHERE video_id = ? AND expires_at > ?",
+            (video_id, time.time()),
+        ).fetchone()
+        return row["reason"] if row else None
+
+    async def add_failed_video(
+        self, video_id: str, reason: str, expires_at: datetime
+    ) -> None:
+        logging.debug("add_failed_video")
+        self.connection.execute(
+            "INSERT OR REPLACE INTO FailedVideo (video_id, reason, expires_at) "
+            "VALUES (?, ?, ?)",
+            (video_id, reason, expires_at.timestamp()),
+        )
@@ -1,10 +1,13 @@
 from . import BaseDB
-from typing import Optional, List, Dict
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional, List, Dict
 from misc import TSBMessage, Status
 import os
 import logging
 from supabase.lib.client_options import ClientOptions
 from supabase import create_async_client
+from postgrest.types import CountMethod, ReturnMethod
+from realtime import RealtimePostgresChangesListenEvent
 
 
 class Supabase(BaseDB):
@@ -32,7 +35,7 @@ class Supabase(BaseDB):
             .limit(1)
             .execute()
         )
-        logging.info(response)
+        logging.debug(response)
         if not response.data:
             return None
         return response.data[0]["newest_msg_id"]
@@ -42,7 +45,7 @@ class Supabase(BaseDB):
         newest_msg_id = max([int(z.msg_id) for z in messages], default=None)
         data = {"nr_msgs_found": len(messages), "newest_msg_id": newest_msg_id}
         response = await self.supabase.table("JobRun").insert(data).execute()
-        logging.info(response)
+        logging.debug(response)
 
     async def insert_message(self, message: TSBMessage) -> None:
         logging.debug("insert_message")
@@ -51,7 +54,33 @@ class Supabase(BaseDB):
             .insert({k: v for k, v in vars(message).items() if k != "id"})
             .execute()
         )
-        logging.info(response)
+        logging.debug(response)
+
+    async def insert_messages(
+        self, messages: List[TSBMessage], record_jobrun: bool = True
+    ) -> int:
+        logging.debug("insert_messages")
+        if not messages:
+            return 0
+        # Single multi-row request. Inserting the same messages again is a no-op,
+        # so a retry after a failed job run insert doesn't create duplicates.
+        # on_conflict needs a unique constraint on msg_id (see the README).
+        response = (
+            await self.supabase.table("TSBMessage")
+            .upsert(
+                [{k: v for k, v in vars(m).items() if k != "id"} for m in messages],
+                on_conflict="msg_id",
+                ignore_duplicates=True,
+                count=CountMethod.exact,
+                returning=ReturnMethod.minimal,
+            )
+            .execute()
+        )
+        logging.debug(response)
+        if record_jobrun:
+            await self.insert_jobrun(messages)
+        # the duplicates aren't counted
+        return len(messages) if response.count is None else response.count
 
     async def get_messages_to_process(self, limit: Optional[int]) -> List[TSBMessage]:
         logging.debug("get_messages_to_process")
@@ -61,7 +90,7 @@ class Supabase(BaseDB):
         if limit:
             query = query.limit(limit)
         response = await query.execute()
-        logging.info(response)
+        logging.debug(response)
         if not response.data:
             return []
         return [
@@ -75,6 +104,52 @@ class Supabase(BaseDB):
             for m in response.data
         ]
 
+    async def claim_messages(
+        self, limit: Optional[int], worker_id: str, lease_sec: int
+    ) -> List[TSBMessage]:
+        logging.debug("claim_messages")
+        now = datetime.now(timezone.utc)
+        claimable = (
+            f"status.eq.{Status.empty.value},"
+            f"and(status.eq.{Status.process_start.value},lease_expires_at.lt.{now.isoformat()})"
+        )
+        query = (
+            self.supabase.table("TSBMessage").select("id").or_(claimable).order("id")
+        )
+        if limit:
+            query = query.limit(limit)
+        response = await query.execute()
+        logging.debug(response)
+        if not response.data:
+            return []
+
+        # The update repeats the claimable filter, so if another worker took some of
+        # these rows in the meantime, they don't match anymore and aren't returned.
+        response = (
+            await self.supabase.table("TSBMessage")
+            .update(
+                {
+                    "status": Status.process_start.value,
+                    "worker_id": worker_id,
+                    "lease_expires_at": (now + timedelta(seconds=lease_sec)).isoformat(),
+                }
+            )
+            .in_("id", [m["id"] for m in response.data])
+            .or_(claimable)
+            .execute()
+        )
+        logging.debug(response)
+        return [
+            TSBMessage(
+                id=m["id"],
+                status=m["status"],
+                msg_text=m["msg_text"],
+                msg_from=m["msg_from"],
+                msg_id=m["msg_id"],
+            )
+            for m in sorted(response.data, key=lambda m: m["id"])
+        ]
+
     async def get_timestamps(self, video_id: str) -> Optional[str]:
         logging.debug("get_timestamps")
         response = (
@@ -84,7 +159,7 @@ class Supabase(BaseDB):
             .limit(1)
             .execute()
         )
-        logging.info(response)
+        logging.debug(response)
         if not response.data:
             return None
         return response.data[0]["timestamps"]
@@ -97,7 +172,39 @@ class Supabase(BaseDB):
             .eq("id", message.id)
             .execute()
         )
-        logging.info(response)
+        logging.debug(response)
+
+    async def extend_lease(
+        self, messages: List[TSBMessage], worker_id: str, lease_sec: int
+    ) -> None:
+        logging.debug("extend_lease")
+        if not messages:
+            return
+        lease_expires_at = datetime.now(timezone.utc) + timedelta(seconds=lease_sec)
+        response = (
+            await self.supabase.table("TSBMessage")
+            .update(
+                {"lease_expires_at": lease_expires_at.isoformat()},
+                returning=ReturnMethod.minimal,
+            )
+            .in_("id", [m.id for m in messages])
+            .eq("status", Status.process_start.value)
+            .eq("worker_id", worker_id)
+            .execute()
+        )
+        logging.debug(response)
+
+    async def update_many(self, messages: List[TSBMessage], status: Status) -> None:
+        logging.debug("update_many")
+        if not messages:
+            return
+        response = (
+            await self.supabase.table("TSBMessage")
+            .update({"status": status.value}, returning=ReturnMethod.minimal)
+            .in_("id", [m.id for m in messages])
+            .execute()
+        )
+        logging.debug(response)
 
     async def add_chapters(self, video_id: str, timestamps: str) -> None:
         logging.debug("add_chapters")
@@ -106,4 +213,52 @@ class Supabase(BaseDB):
             .insert({"video_id": video_id, "timestamps": timestamps})
             .execute()
         )
-        logging.info(response)
+        logging.debug(response)
+
+    async def get_failed_video(self, video_id: str) -> Optional[str]:
+        logging.debug("get_failed_video")
+        response = (
+            await self.supabase.table("FailedVideo")
+            .select("reason")
+            .eq("video_id", video_id)
+            .gt("expires_at", datetime.now(timezone.utc).isoformat())
+            .limit(1)
+            .execute()
+        )
+        logging.debug(response)
+        if not response.data:
+            return None
+        return response.data[0]["reason"]
+
+    async def add_failed_video(
+        self, video_id: str, reason: str, expires_at: datetime
+    ) -> None:
+        logging.debug("add_failed_video")
+        response = (
+            await self.supabase.table("FailedVideo")
+            .upsert(
+                {
+                    "video_id": video_id,
+                    "reason": reason,
+                    "expires_at": expires_at.isoformat(),
+                },
+                on_conflict="video_id",
+            )
+            .execute()
+        )
+        logging.debug(response)
+
+    async def subscribe_new_messages(self, callback: Callable) -> bool:
+        logging.debug("subscribe_new_messages")
+        # Needs Realtime to be enabled for the TSBMessage table in Supabase.
+        if os.environ.get("SUPABASE_REALTIME", "").lower() not in ("1", "true", "yes"):
+            return False
+        channel = self.supabase.channel("tsb-messages")
+        channel.on_postgres_changes(
+            RealtimePostgresChangesListenEvent.Insert,
+            callback,
+            table="TSBMessage",
+            schema="public",
+        )
+        await channel.subscribe()
+        return True
@@ -0,0 +1,108 @@
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+
+DEFAULT_RETRY_ATTEMPTS = 3
+RETRY_BASE_DELAY_SEC = 1
+RETRY_MAX_DELAY_SEC = 30
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+def time_left(deadline):
+    # Seconds until the deadline (a time.time() value, shared across threads and
+    # processes), or None when there's no deadline. Raises once it's passed.
+    if deadline is None:
+        return None
+    left = deadline - time.time()
+    if left <= 0:
+        raise DeadlineExceeded("The deadline of the message has passed")
+    return left
+
+
+def call_timeout(timeout, deadline):
+    # The timeout for one call: its own timeout, shortened to the time left.
+    left = time_left(deadline)
+    return timeout if left is None else min(timeout, left)
+
+
+def retry(name, call, deadline=None, permanent=()):
+    # Calls call() up to RETRY_ATTEMPTS times, with an exponential, jittered
+    # delay between the attempts, as long as the deadline allows it. The
+    # exceptions in `permanent` (and DeadlineExceeded) are raised right away.
+    # 429s are also retried: the rate limiters already hold the next attempt
+    # back for as long as the server asked.
+    attempts = int(os.environ.get("RETRY_ATTEMPTS", DEFAULT_RETRY_ATTEMPTS))
+    for attempt in range(1, max(attempts, 1) + 1):
+        try:
+            return call()
+        except (DeadlineExceeded, *permanent):
+            raise
+        except Exception as e:
+            if attempt >= attempts:
+                raise
+            delay = min(RETRY_BASE_DELAY_SEC * 2 ** (attempt - 1), RETRY_MAX_DELAY_SEC)
+            delay *= random.uniform(0.5, 1.5)
+            left = time_left(deadline)
+            if left is not None and left <= delay:
+                raise
+            logging.warning(
+                f"{name} - attempt {attempt} failed, retrying in {delay:.1f}s. {e}"
+            )
+            time.sleep(delay)
+
+
+def hedged(executor, calls, hedge_after, deadline=None, permanent=()):
+    # Runs calls[0] on the executor. If it's still running after hedge_after
+    # seconds (or failed), starts calls[1], and so on. Returns the result of the
+    # first call that succeeds. The others can't be interrupted: they finish on
+    # their own (bounded by their timeouts) and their results are dropped.
+    pending = {executor.submit(calls[0])}
+    next_call = 1
+    error = None
+    while True:
+        can_hedge = next_call < len(calls)
+        timeout = hedge_after if can_hedge else None
+        left = time_left(deadline)
+        if left is not None:
+            timeout = left if timeout is None else min(timeout, left)
+        done, pending = wait(pending, timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+            if isinstance(error, permanent):
+                raise error
+        if not pending and not can_hedge:
+            raise error
+        if can_hedge and (not done or not pending):
+            logging.info(f"Hedging with call {next_call + 1} of {len(calls)}")
+            pending.add(executor.submit(calls[next_call]))
+            next_call += 1
+
+
+class LatencyTracker:
+    # The latencies of the last `size` calls of one kind, to know when a call is
+    # unusually slow. Thread-safe.
+    def __init__(self, size=200, min_samples=20):
+        self.min_samples = min_samples
+        self._latencies = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, latency):
+        with self._lock:
+            self._latencies.append(latency)
+
+    def percentile(self, p):
+        # None until there are enough samples.
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            latencies = sorted(self._latencies)
+        return latencies[min(int(p / 100 * len(latencies)), len(latencies) - 1)]
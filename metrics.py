@@ -0,0 +1,202 @@
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_METRICS_PORT = 9100
+DEFAULT_METRICS_FILE = "metrics.prom"
+DEFAULT_METRICS_INTERVAL_SEC = 15
+# Upper bounds (seconds) of the histogram buckets. The stages go from
+# milliseconds (cache lookups) to minutes (long videos).
+BUCKETS = (0.005, 0.025, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+HELP = {
+    "tsb_stage_duration_seconds": "Time spent in each stage of the pipeline.",
+    "tsb_stage_errors_total": "Stages that ended with an exception.",
+    "tsb_cache_requests_total": "Cache lookups, by cache and result.",
+    "tsb_messages_total": "Messages that reached a status.",
+    "tsb_rate_limited_total": "Calls rejected by a server with a 429.",
+    "tsb_messages_collected_total": "Messages received from the platform.",
+    "tsb_work_queue_depth": "Collected messages not yet taken by the processor.",
+    "tsb_messages_in_flight": "Videos being processed.",
+    "tsb_backlog_messages": "Claimed messages waiting for a free slot.",
+}
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ""
+    escaped = (
+        (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in pairs
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+class Metrics:
+    # Counters, gauges and histograms kept in memory and rendered in the
+    # Prometheus text format, which is also valid OpenMetrics once "# EOF" is
+    # added. Updated from the event loop and from the executor threads. With
+    # TIMESTAMPS_EXECUTOR=process, what happens inside the worker processes
+    # isn't recorded, only the total time seen from the processor.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self.gauges[_key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                # one count per bucket, then the sum and the total count
+                histogram = self.histograms[key] = [0] * len(BUCKETS) + [0.0, 0]
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    histogram[i] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    @contextmanager
+    def span(self, stage, **labels):
+        # Times the block as tsb_stage_duration_seconds{stage=...}. Works the
+        # same around sync and async code (`with`, not `async with`).
+        started = time.monotonic()
+        try:
+            yield
+        except BaseException:
+            self.inc("tsb_stage_errors_total", stage=stage, **labels)
+            raise
+        finally:
+            self.observe(
+                "tsb_stage_duration_seconds",
+                time.monotonic() - started,
+                stage=stage,
+                **labels,
+            )
+
+    def render(self):
+        with self._lock:
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+            histograms = {k: list(v) for k, v in self.histograms.items()}
+        lines = []
+        for kind, values in (("counter", counters), ("gauge", gauges)):
+            for name in sorted({name for name, _ in values}):
+                lines.append(f"# HELP {name} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} {kind}")
+                for (key_name, labels), value in sorted(values.items()):
+                    if key_name == name:
+                        lines.append(f"{name}{_format_labels(labels)} {value}")
+        for name in sorted({name for name, _ in histograms}):
+            lines.append(f"# HELP {name} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} histogram")
+            for (key_name, labels), histogram in sorted(histograms.items()):
+                if key_name != name:
+                    continue
+                for bound, count in zip(BUCKETS, histogram):
+                    lines.append(
+                        f"{name}_bucket{_format_labels(labels, [('le', bound)])} {count}"
+                    )
+                lines.append(
+                    f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {histogram[-1]}"
+                )
+                lines.append(f"{name}_sum{_format_labels(labels)} {histogram[-2]}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+class PrometheusSink:
+    # Serves the metrics on http://<host>:<port>/metrics from a daemon thread.
+    def __init__(self, port, metrics=metrics):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        registry = metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("", port), Handler)
+        threading.Thread(
+            target=self.server.serve_forever, name="metrics", daemon=True
+        ).start()
+        logging.info(f"Serving metrics on port {port}")
+
+    def close(self):
+        self.server.shutdown()
+
+
+class FileSink:
+    # Writes the metrics to an OpenMetrics file every `interval` seconds, for the
+    # node_exporter textfile collector or to be read after a benchmark.
+    def __init__(self, path, interval, metrics=metrics):
+        self.path = path
+        self.interval = interval
+        self.metrics = metrics
+        self._stop = threading.Event()
+        threading.Thread(target=self._run, name="metrics", daemon=True).start()
+        logging.info(f"Writing metrics to {path} every {interval} seconds")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def write(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_file = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(self.metrics.render() + "# EOF\n")
+            os.replace(tmp_file, self.path)
+        except Exception as e:
+            logging.error(f"Error when writing the metrics. {e}")
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+    def close(self):
+        self._stop.set()
+        self.write()
+
+
+def start_metrics_sink():
+    # METRICS_SINK: "prometheus", "file" or empty (metrics are only kept in memory).
+    sink = os.environ.get("METRICS_SINK", "").lower()
+    if sink == "prometheus":
+        return PrometheusSink(
+            int(os.environ.get("METRICS_PORT", DEFAULT_METRICS_PORT))
+        )
+    if sink == "file":
+        return FileSink(
+            os.environ.get("METRICS_FILE", DEFAULT_METRICS_FILE),
+            int(os.environ.get("METRICS_INTERVAL_SEC", DEFAULT_METRICS_INTERVAL_SEC)),
+        )
+    return None
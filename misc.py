@@ -20,3 +20,4 @@ class Status(Enum):
     answered = 3
     invalid = 4
     failed_timestamps = 5
+    failed_reply = 6
@@ -1,4 +1,14 @@
+import importlib
+
 from .base_platform import BasePlatform
-from .twitter import Twitter
+
+# The platforms are imported on first access (PEP 562), together with their SDK.
+_PLATFORMS = {"Twitter": ".twitter"}
 
 __all__ = ["BasePlatform", "Twitter"]
+
+
+def __getattr__(name):
+    if name in _PLATFORMS:
+        return getattr(importlib.import_module(_PLATFORMS[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import List, Tuple, Dict
+from typing import AsyncIterator, List, Tuple, Dict
 from misc import TSBMessage
 
 
@@ -11,12 +11,23 @@ class BasePlatform(ABC):
         # and use an internal service to redirect to the original URL
         pass
 
+    async def get_original_urls(self, messages_text: List[str]) -> List[str]:
+        # Resolves the urls of several messages at once
+        return [await self.get_original_url(text) for text in messages_text]
+
     @abstractmethod
     async def gather_messages(self, since_message_id: str) -> List[TSBMessage]:
         # Get latest messages that mention a particular user
         # and are newer than the message id of since_message_id
         pass
 
+    async def iter_messages(
+        self, since_message_id: str
+    ) -> AsyncIterator[List[TSBMessage]]:
+        # Same messages as gather_messages, but yielded page by page
+        # as they are received from the platform
+        yield await self.gather_messages(since_message_id)
+
     @abstractmethod
     async def reply(self, text: str, platform_message_id: str) -> None:
         # Reply to a message with the id = platform_message_id
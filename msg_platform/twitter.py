@@ -1,12 +1,20 @@
 from . import BasePlatform
-from typing import List, Tuple, Dict
+from typing import AsyncIterator, List, Tuple, Dict
 from misc import TSBMessage, Status
 import os
 import logging
 from tweepy.asynchronous import AsyncClient
-import requests
+import aiohttp
+import asyncio
 from urllib.parse import urlparse
 import re
+from cache import LRUCache
+from rate_limit import get_limiter
+
+DEFAULT_URL_CACHE_SIZE = 4096
+DEFAULT_URL_RESOLVE_TIMEOUT_SEC = 10
+# The mentions timeline only goes back this many tweets, even with pagination.
+MENTIONS_TIMELINE_LIMIT = 800
 
 
 class Twitter(BasePlatform):
@@ -23,28 +31,77 @@ class Twitter(BasePlatform):
             access_token_secret=access_token_secret,
         )
         self.timestampbuddy_userid = os.environ.get("X_USERID", "")
+        # t.co short link -> original url
+        self.url_cache = LRUCache(
+            max_size=int(os.environ.get("URL_CACHE_SIZE", DEFAULT_URL_CACHE_SIZE))
+        )
+        self._http = None
+
+    def _get_http_session(self):
+        # Created lazily because aiohttp sessions must be created inside the event loop.
+        # Kept for the lifetime of the app so the connections to t.co are reused.
+        if self._http is None or self._http.closed:
+            timeout = int(
+                os.environ.get(
+                    "URL_RESOLVE_TIMEOUT_SEC", DEFAULT_URL_RESOLVE_TIMEOUT_SEC
+                )
+            )
+            self._http = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=timeout),
+                connector=aiohttp.TCPConnector(limit=20, keepalive_timeout=60),
+            )
+        return self._http
 
     async def gather_messages(self, since_message_id: str) -> List[TSBMessage]:
         logging.debug("gather_messages")
-        response = await self.client.get_users_mentions(
-            id=self.timestampbuddy_userid,
-            expansions="author_id",
-            user_auth=True,
-            max_results=100,
-            since_id=since_message_id,
-        )
-        logging.info(response)
-        if not response.data:
-            return []
+        messages = []
+        async for page in self.iter_messages(since_message_id):
+            messages.extend(page)
+        return messages
+
+    async def iter_messages(
+        self, since_message_id: str
+    ) -> AsyncIterator[List[TSBMessage]]:
+        logging.debug("iter_messages")
+        pagination_token = None
+        total = 0
+        while True:
+            async with get_limiter("x_mentions").aslot():
+                response = await self.client.get_users_mentions(
+                    id=self.timestampbuddy_userid,
+                    expansions="author_id",
+                    user_auth=True,
+                    max_results=100,
+                    since_id=since_message_id,
+                    pagination_token=pagination_token,
+                    tweet_fields=["entities"],
+                )
+            logging.debug(response)
+            if response.data:
+                total += len(response.data)
+                yield self._to_messages(response)
+            pagination_token = (response.meta or {}).get("next_token")
+            if not pagination_token:
+                break
+
+        if since_message_id and total >= MENTIONS_TIMELINE_LIMIT:
+            logging.warning(
+                f"Collected {total} mentions since {since_message_id}, but X only returns the latest {MENTIONS_TIMELINE_LIMIT}. Older mentions in this range were probably missed."
+            )
+
+    def _to_messages(self, response) -> List[TSBMessage]:
+        users = {u.id: u.username for u in (response.includes or {}).get("users", [])}
+        # The payload already has the original urls of the t.co links,
+        # so they don't need to be resolved again when processing.
+        for m in response.data:
+            for url in (m.entities or {}).get("urls", []):
+                if url.get("expanded_url"):
+                    self.url_cache.set(url["url"], url["expanded_url"])
         return [
             TSBMessage(
                 status=Status.empty.value,
                 msg_text=m.text,
-                msg_from=next(
-                    x.username
-                    for x in response.includes["users"]
-                    if x.id == m.author_id
-                ),
+                msg_from=users.get(m.author_id),
                 msg_id=m["id"],
             )
             for m in response.data
@@ -52,12 +109,13 @@ class Twitter(BasePlatform):
 
     async def reply(self, text: str, platform_message_id: str) -> None:
         logging.debug("reply")
-        response = await self.client.create_tweet(
-            text=text, in_reply_to_tweet_id=platform_message_id
-        )
-        logging.info(response)
+        async with get_limiter("x_reply").aslot():
+            response = await self.client.create_tweet(
+                text=text, in_reply_to_tweet_id=platform_message_id
+            )
+        logging.debug(response)
 
-    def get_original_url(self, message_text: str) -> str:
+    async def get_original_url(self, message_text: str) -> str:
         logging.debug("get_original_url")
 
         # https://stackoverflow.com/a/6041965
@@ -70,13 +128,24 @@ class Twitter(BasePlatform):
             parsed_url = urlparse(url)
 
             if parsed_url.netloc == "t.co":
-                response = requests.head(url, allow_redirects=True)
-                logging.info(response.url)
-                return response.url
+                original_url = self.url_cache.get(url)
+                if original_url is None:
+                    async with self._get_http_session().head(
+                        url, allow_redirects=True
+                    ) as response:
+                        original_url = str(response.url)
+                    self.url_cache.set(url, original_url)
+                logging.info(original_url)
+                return original_url
 
             return url
         except Exception as e:
             return url
 
+    async def get_original_urls(self, messages_text: List[str]) -> List[str]:
+        return await asyncio.gather(
+            *(self.get_original_url(text) for text in messages_text)
+        )
+
     def get_max_response_length(self) -> int:
         return 280
\ No newline at end of file
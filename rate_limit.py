@@ -0,0 +1,268 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+from deadline import DeadlineExceeded
+from metrics import metrics
+
+DEFAULT_MAX_CONCURRENCY = 4
+# Wait after a 429 that doesn't say for how long.
+DEFAULT_RETRY_AFTER_SEC = 5
+# Status codes of a server (or gateway) that timed out.
+TIMEOUT_STATUS_CODES = (408, 504)
+
+
+class TokenBucket:
+    # `rate` tokens per second, up to `capacity`. Not thread-safe on its own,
+    # RateLimiter guards it with its lock.
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def reserve(self, tokens, now):
+        # Takes the tokens right away (going into debt if needed) and returns how
+        # long the caller has to wait until they are actually available.
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+        self.tokens -= tokens
+        if self.tokens >= 0:
+            return 0
+        return -self.tokens / self.rate
+
+
+class RateLimiter:
+    # Client side limits for one external dependency: requests per minute, tokens
+    # per minute and a number of concurrent calls that adapts to the observed
+    # errors (halved on 429s and timeouts, slowly increased back
+    # on successes). Used both from executor threads (slot) and from the event
+    # loop (aslot).
+    def __init__(self, name, rpm=0, tpm=0, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        self.name = name
+        self.requests = TokenBucket(rpm / 60, rpm) if rpm else None
+        self.tokens = TokenBucket(tpm / 60, tpm) if tpm else None
+        self.max_concurrency = max(max_concurrency, 1)
+        self.concurrency = float(self.max_concurrency)
+        self.in_flight = 0
+        self.blocked_until = 0
+        self._cond = threading.Condition()
+        self._async_waiters = deque()
+
+    @classmethod
+    def from_env(cls, name):
+        prefix = name.upper()
+        return cls(
+            name,
+            rpm=int(os.environ.get(f"{prefix}_RPM", 0)),
+            tpm=int(os.environ.get(f"{prefix}_TPM", 0)),
+            max_concurrency=int(
+                os.environ.get(f"{prefix}_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY)
+            ),
+        )
+
+    def _try_take_slot(self):
+        if self.in_flight < int(self.concurrency):
+            self.in_flight += 1
+            return True
+        return False
+
+    def _reserve(self, tokens):
+        # Must be called with the lock held. Takes the request and the tokens
+        # from the budget and returns how long to wait until they're available.
+        now = time.monotonic()
+        wait = max(self.blocked_until - now, 0)
+        if self.requests:
+            wait = max(wait, self.requests.reserve(1, now))
+        if self.tokens and tokens:
+            wait = max(wait, self.tokens.reserve(tokens, now))
+        return wait
+
+    def acquire(self, tokens=0):
+        with metrics.span("rate_limit_wait", limiter=self.name):
+            self._acquire(tokens)
+
+    # The budget is waited for before taking a concurrency slot, so the callers
+    # paused by the RPM/TPM limits or a 429 don't hold the slots of the others.
+    # A 429 received meanwhile pauses them again before they take one.
+    def _acquire(self, tokens):
+        with self._cond:
+            wait = self._reserve(tokens)
+        if wait:
+            logging.debug(f"{self.name} - rate limited, waiting {wait:.1f}s")
+            time.sleep(wait)
+        with self._cond:
+            while True:
+                blocked = self.blocked_until - time.monotonic()
+                if blocked > 0:
+                    self._cond.wait(blocked)
+                elif self._try_take_slot():
+                    return
+                else:
+                    self._cond.wait()
+
+    async def acquire_async(self, tokens=0):
+        with metrics.span("rate_limit_wait", limiter=self.name):
+            await self._acquire_async(tokens)
+
+    async def _acquire_async(self, tokens):
+        # Nothing is awaited once the slot is taken, so a cancelled caller never
+        # holds one.
+        with self._cond:
+            wait = self._reserve(tokens)
+        if wait:
+            logging.debug(f"{self.name} - rate limited, waiting {wait:.1f}s")
+            await asyncio.sleep(wait)
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._cond:
+                blocked = self.blocked_until - time.monotonic()
+                if blocked <= 0:
+                    if self._try_take_slot():
+                        return
+                    future = loop.create_future()
+                    self._async_waiters.append((loop, future))
+            if blocked > 0:
+                await asyncio.sleep(blocked)
+            else:
+                await future
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._wake_waiters()
+
+    def _wake_waiters(self):
+        self._cond.notify_all()
+        while self._async_waiters:
+            loop, future = self._async_waiters.popleft()
+            loop.call_soon_threadsafe(_set_done, future)
+
+    def on_success(self):
+        # Additive increase. The latency isn't used: the calls of one service
+        # vary too much (a chunk of a long video vs a short chat turn) to tell
+        # congestion from a bigger request.
+        with self._cond:
+            self.concurrency = min(
+                self.concurrency + 1 / self.concurrency, self.max_concurrency
+            )
+            self._wake_waiters()
+
+    def on_error(self, error):
+        if is_timeout(error):
+            logging.warning(f"{self.name} - call timed out, reducing the concurrency")
+            with self._cond:
+                self._decrease()
+            return
+        if not is_rate_limited(error):
+            return
+        retry_after = get_retry_after(error)
+        logging.warning(
+            f"{self.name} - rate limited by the server, pausing for {retry_after:.1f}s"
+        )
+        metrics.inc("tsb_rate_limited_total", limiter=self.name)
+        with self._cond:
+            self.blocked_until = max(
+                self.blocked_until, time.monotonic() + retry_after
+            )
+            self._decrease()
+
+    def _decrease(self):
+        self.concurrency = max(self.concurrency / 2, 1)
+
+    # The slot is always given back, also when the caller is cancelled (a
+    # deadline, a hedged call that lost): CancelledError isn't an Exception and
+    # isn't counted as an error of the service.
+    @contextmanager
+    def slot(self, tokens=0):
+        self.acquire(tokens)
+        try:
+            yield
+        except Exception as e:
+            self.on_error(e)
+            raise
+        else:
+            self.on_success()
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def aslot(self, tokens=0):
+        await self.acquire_async(tokens)
+        try:
+            yield
+        except Exception as e:
+            self.on_error(e)
+            raise
+        else:
+            self.on_success()
+        finally:
+            self.release()
+
+
+def _set_done(future):
+    if not future.done():
+        future.set_result(None)
+
+
+def _status_code(error):
+    for obj in (error, getattr(error, "response", None)):
+        for attr in ("code", "status_code", "status"):
+            value = getattr(obj, attr, None)
+            if isinstance(value, int):
+                return value
+    return None
+
+
+def is_rate_limited(error):
+    return _status_code(error) == 429 or type(error).__name__ in (
+        "TooManyRequests",
+        "ResourceExhausted",
+        "RequestBlocked",
+        "IpBlocked",
+    )
+
+
+def is_timeout(error):
+    # The deadline of the message isn't a sign of congestion, only the
+    # timeouts of the calls themselves are.
+    if isinstance(error, DeadlineExceeded):
+        return False
+    return (
+        isinstance(error, TimeoutError)
+        or _status_code(error) in TIMEOUT_STATUS_CODES
+        or type(error).__name__
+        in ("Timeout", "ReadTimeout", "ConnectTimeout", "DeadlineExceeded")
+    )
+
+
+def get_retry_after(error):
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        if headers.get("Retry-After"):
+            return float(headers["Retry-After"])
+        # X sends the epoch second when the rate limit window resets.
+        if headers.get("x-rate-limit-reset"):
+            return max(float(headers["x-rate-limit-reset"]) - time.time(), 0)
+    except ValueError:
+        pass
+    return DEFAULT_RETRY_AFTER_SEC
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(name):
+    # One shared limiter per external dependency, configured from the env
+    # (<NAME>_RPM, <NAME>_TPM, <NAME>_MAX_CONCURRENCY).
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = RateLimiter.from_env(name)
+        return _limiters[name]
@@ -0,0 +1,64 @@
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, List, Tuple
+
+from misc import TSBMessage
+
+
+class Scheduler:
+    # Decides in which order the claimed videos are started, instead of strict
+    # claim (id) order:
+    # - videos that are nearly free (timestamps already cached) are taken
+    #   right away, without waiting for a slot;
+    # - the others are taken round-robin across the users who asked for them,
+    #   so one user with many mentions doesn't delay everybody else.
+    # A video is always taken with all its messages, from all the users.
+    def __init__(self):
+        self.videos: Dict[str, List[TSBMessage]] = {}
+        # msg_from -> its videos in claim order. The user served the longest
+        # time ago comes first.
+        self.users: "OrderedDict[str, Deque[str]]" = OrderedDict()
+
+    def __len__(self):
+        return len(self.videos)
+
+    def add(self, video_id: str, message: TSBMessage) -> None:
+        if video_id not in self.videos:
+            self.videos[video_id] = []
+        self.videos[video_id].append(message)
+        user_videos = self.users.get(message.msg_from)
+        if user_videos is None:
+            user_videos = self.users[message.msg_from] = deque()
+        if video_id not in user_videos:
+            user_videos.append(video_id)
+
+    def clear(self) -> None:
+        self.videos.clear()
+        self.users.clear()
+
+    def message_count(self) -> int:
+        return sum(map(len, self.videos.values()))
+
+    def take_ready(
+        self, is_ready: Callable[[str], bool]
+    ) -> List[Tuple[str, List[TSBMessage]]]:
+        # Takes all the videos for which is_ready(video_id) is true.
+        return [
+            (video_id, self.videos.pop(video_id))
+            for video_id in list(self.videos)
+            if is_ready(video_id)
+        ]
+
+    def take(self, count: int) -> List[Tuple[str, List[TSBMessage]]]:
+        groups = []
+        while len(groups) < count and self.users:
+            user, user_videos = next(iter(self.users.items()))
+            # skip the videos already taken for another user
+            while user_videos and user_videos[0] not in self.videos:
+                user_videos.popleft()
+            if not user_videos:
+                del self.users[user]
+                continue
+            video_id = user_videos.popleft()
+            groups.append((video_id, self.videos.pop(video_id)))
+            self.users.move_to_end(user)
+        return groups
@@ -0,0 +1,56 @@
+import asyncio
+import logging
+import traceback
+from typing import Dict, Tuple
+
+from db import BaseDB
+from metrics import metrics
+from misc import Status, TSBMessage
+
+
+class StatusBuffer:
+    # Write-behind buffer for the message statuses that don't guard anything
+    # (answered, invalid, failed_timestamps). They are kept in memory and written
+    # every `flush_interval` seconds, or sooner once `max_batch` are waiting, with
+    # one update_many per status. Transitions of the same message are coalesced:
+    # only its last status is written. The db is behind by at most flush_interval
+    # seconds (plus the time of a failed flush, whose statuses are retried).
+    def __init__(self, db: BaseDB, flush_interval: float, max_batch: int):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.pending: Dict[int, Tuple[TSBMessage, Status]] = {}
+        self._full = asyncio.Event()
+
+    def set(self, message: TSBMessage, status: Status) -> None:
+        self.pending[message.id] = (message, status)
+        if len(self.pending) >= self.max_batch:
+            self._full.set()
+
+    async def flush(self) -> None:
+        self._full.clear()
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, {}
+        by_status: Dict[Status, list] = {}
+        for message, status in pending.values():
+            by_status.setdefault(status, []).append(message)
+        for status, messages in by_status.items():
+            try:
+                with metrics.span("db_update_many", status=status.name):
+                    await self.db.update_many(messages, status)
+            except Exception as e:
+                logging.error(
+                    f"Error when updating {len(messages)} messages to {status.name}, will retry. {traceback.format_exc()} {e}"
+                )
+                for message in messages:
+                    # unless a newer status was set in the meantime
+                    self.pending.setdefault(message.id, (message, status))
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
@@ -0,0 +1,115 @@
+import asyncio
+import time
+
+import pytest
+
+from cache import LRUCache, SingleFlight
+
+
+def test_lru_evicts_the_least_recently_used():
+    cache = LRUCache(max_size=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert "b" not in cache
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+
+
+def test_lru_entries_expire_after_their_ttl(monkeypatch):
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now)
+    cache = LRUCache(ttl=10)
+    cache.set("default", 1)
+    cache.set("own", 2, ttl=60)
+    cache.set("forever", 3, ttl=0)
+    now += 30
+    assert cache.get("default") is None
+    assert cache.get("own") == 2
+    now += 3600
+    assert cache.get("own") is None
+    # a ttl of 0 never expires
+    assert cache.get("forever") == 3
+
+
+def test_single_flight_shares_the_result():
+    single_flight = SingleFlight()
+    calls = 0
+
+    async def compute():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def run():
+        return await asyncio.gather(
+            *(single_flight.do("key", compute) for _ in range(3))
+        )
+
+    assert asyncio.run(run()) == ["result"] * 3
+    assert calls == 1
+
+
+def test_single_flight_shares_the_exception():
+    single_flight = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    async def run():
+        return await asyncio.gather(
+            single_flight.do("key", fail),
+            single_flight.do("key", fail),
+            return_exceptions=True,
+        )
+
+    errors = asyncio.run(run())
+    assert [type(e) for e in errors] == [ValueError, ValueError]
+    assert "key" not in single_flight
+
+
+def test_single_flight_cancelled_owner_doesnt_leak_the_key():
+    single_flight = SingleFlight()
+
+    async def run():
+        owner = asyncio.create_task(single_flight.do("key", asyncio.Event().wait))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(single_flight.do("key", asyncio.Event().wait))
+        await asyncio.sleep(0)
+        owner.cancel()
+        for task in (owner, waiter):
+            with pytest.raises(asyncio.CancelledError):
+                await task
+        assert "key" not in single_flight
+
+        # the next caller computes the value again
+        async def compute():
+            return "result"
+
+        return await single_flight.do("key", compute)
+
+    assert asyncio.run(run()) == "result"
+
+
+def test_single_flight_cancelled_waiter_doesnt_cancel_the_owner():
+    single_flight = SingleFlight()
+
+    async def compute():
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def run():
+        owner = asyncio.create_task(single_flight.do("key", compute))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(single_flight.do("key", compute))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        return await owner
+
+    assert asyncio.run(run()) == "result"
@@ -0,0 +1,60 @@
+import pytest
+
+from chapters import fit_chapters, format_timestamp, parse_chapters
+
+
+def test_format_timestamp():
+    assert format_timestamp(0) == "0:00"
+    assert format_timestamp(783) == "13:03"
+    assert format_timestamp(4373) == "1:12:53"
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        '[{"start": 75, "title": "Setup"}, {"start": 0, "title": "Intro"}]',
+        '```json\n[{"start": "0:00", "title": "Intro"}, {"start": "1:15", "title": "Setup"}]\n```',
+        '```\n{"chapters": [{"start": 0, "title": "Intro"}, {"start": 75, "title": "Setup"}]}\n```',
+    ],
+)
+def test_parse_chapters(text):
+    assert parse_chapters(text) == [(0, "Intro"), (75, "Setup")]
+
+
+def test_parse_chapters_normalizes_titles_and_skips_empty_ones():
+    text = '[{"start": 0, "title": " Intro\\n  part 1 "}, {"start": 10, "title": " "}]'
+    assert parse_chapters(text) == [(0, "Intro part 1")]
+
+
+def test_parse_chapters_without_chapters_raises():
+    with pytest.raises(ValueError):
+        parse_chapters("[]")
+    with pytest.raises(ValueError):
+        parse_chapters("```json\nnot json\n```")
+
+
+def test_fit_chapters_starts_at_zero_and_drops_duplicates():
+    chapters = [(5, "Intro"), (5, "Same start"), (60, "Setup")]
+    assert fit_chapters(chapters, 1000) == "0:00 - Intro\n1:00 - Setup"
+
+
+def test_fit_chapters_merges_the_shortest_neighbours():
+    chapters = [(0, "Intro"), (600, "A"), (610, "B"), (1200, "Outro")]
+    # "A" and "B" together are the shortest, B is merged into A
+    assert fit_chapters(chapters, 36, end=1800) == "0:00 - Intro\n10:00 - A\n20:00 - Outro"
+
+
+def test_fit_chapters_is_within_max_length():
+    chapters = [(i * 60, f"Chapter number {i}") for i in range(50)]
+    text = fit_chapters(chapters, 280, end=3000)
+    assert len(text) <= 280
+    assert text.startswith("0:00 - Chapter number 0")
+    # a single chapter too long for max_length is cut
+    assert fit_chapters([(0, "A very long title")], 10) == "0:00 - A v"
+
+
+def test_fit_chapters_drops_the_chapters_after_the_end():
+    chapters = [(0, "Intro"), (300, "Setup"), (960, "Outro"), (9600, "Made up")]
+    assert fit_chapters(chapters, 1000, end=960) == "0:00 - Intro\n5:00 - Setup"
+    # the first chapter is always kept
+    assert fit_chapters([(1200, "Intro")], 1000, end=960) == "0:00 - Intro"
@@ -0,0 +1,269 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from benchmarks.fakes import FakeEngine, FakePlatform
+from cron_processor import CronProcessor, KnownFailedVideo
+from db import InMemory
+from misc import Status, TSBMessage
+
+
+class CountingDB(InMemory):
+    def __init__(self):
+        super().__init__()
+        self.failed_video_queries = 0
+
+    async def get_failed_video(self, video_id):
+        self.failed_video_queries += 1
+        return await super().get_failed_video(video_id)
+
+
+def test_chaptered_video_skips_the_failed_videos_query():
+    db = CountingDB()
+    processor = CronProcessor(db, platform=None, engine=None)
+
+    async def run():
+        await db.add_chapters("v0000000001", "0:00 - Intro")
+        return await processor._get_or_create_timestamps("v0000000001")
+
+    assert asyncio.run(run()) == "0:00 - Intro"
+    assert db.failed_video_queries == 0
+
+
+def test_failed_video_is_known_after_a_timestamps_miss():
+    db = CountingDB()
+    processor = CronProcessor(db, platform=None, engine=None)
+
+    async def run():
+        await db.add_failed_video(
+            "v0000000001",
+            "TranscriptsDisabled",
+            datetime.now(timezone.utc) + timedelta(hours=1),
+        )
+        await processor._get_or_create_timestamps("v0000000001")
+
+    with pytest.raises(KnownFailedVideo):
+        asyncio.run(run())
+    assert db.failed_video_queries == 1
+
+
+def test_failed_videos_cache_has_its_own_size(monkeypatch):
+    monkeypatch.setenv("TIMESTAMPS_CACHE_SIZE", "10")
+    monkeypatch.setenv("FAILED_VIDEOS_CACHE_SIZE", "3")
+    processor = CronProcessor(InMemory(), platform=None, engine=None)
+    assert processor.timestamps_cache.max_size == 10
+    assert processor.failed_videos_cache.max_size == 3
+
+
+def test_empty_claim_drops_the_stale_wakeups():
+    processor = CronProcessor(InMemory(), platform=None, engine=None)
+
+    async def run():
+        # e.g. messages inserted, then claimed by another worker
+        await processor._notify_new_work(5)
+        await processor._fill_backlog()
+        return processor.work_queue.qsize()
+
+    assert asyncio.run(run()) == 0
+
+
+def mention(msg_id, text):
+    return TSBMessage(
+        status=Status.empty.value, msg_text=text, msg_from="user", msg_id=str(msg_id)
+    )
+
+
+def test_batch_without_videos_doesnt_make_the_processor_idle(monkeypatch):
+    monkeypatch.setenv("CLAIM_BATCH_SIZE", "2")
+    monkeypatch.setenv("PROCESSOR_IDLE_INTERVAL_SEC", "300")
+    monkeypatch.setenv("STATUS_FLUSH_INTERVAL_SEC", "0.01")
+    db = InMemory()
+    platform = FakePlatform(reply_latency=0)
+    processor = CronProcessor(db, platform, FakeEngine(llm_latency=0.01))
+
+    async def run():
+        await db.insert_messages(
+            [
+                mention(1, "hello"),
+                mention(2, "hello again"),
+                mention(3, "@TimeStampBuddy https://youtu.be/v0000000001"),
+            ]
+        )
+        task = asyncio.create_task(processor.run_data_processor())
+        try:
+            for _ in range(100):
+                await asyncio.sleep(0.02)
+                if "3" in platform.replies:
+                    break
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(run())
+    assert "3" in platform.replies
+    assert [m.status for m in db.messages.values()] == [
+        Status.invalid.value,
+        Status.invalid.value,
+        Status.answered.value,
+    ]
+
+
+def test_leases_of_the_messages_being_processed_are_renewed(monkeypatch):
+    monkeypatch.setenv("LEASE_SEC", "1")
+    db = InMemory()
+    processor = CronProcessor(db, platform=None, engine=None)
+
+    async def run():
+        await db.insert_messages([mention(1, "https://youtu.be/v0000000001")])
+        claimed = await db.claim_messages(1, processor.worker_id, 1)
+        processor.processing[claimed[0].id] = claimed[0]
+        renewer = asyncio.create_task(processor._renew_leases())
+        await asyncio.sleep(1.2)
+        renewer.cancel()
+        # the lease was extended at ~1s, up to ~2s
+        return await db.claim_messages(1, "another-worker", 1)
+
+    assert asyncio.run(run()) == []
+
+
+def test_backlog_close_to_its_lease_end_is_given_back(monkeypatch):
+    monkeypatch.setenv("LEASE_SEC", "1800")
+    monkeypatch.setenv("MESSAGE_DEADLINE_SEC", "900")
+    db = InMemory()
+    processor = CronProcessor(db, platform=None, engine=None)
+
+    async def run():
+        await db.insert_messages([mention(1, "https://youtu.be/v0000000001")])
+        claimed = await db.claim_messages(1, processor.worker_id, 1800)
+        processor.backlog.add("v0000000001", claimed[0])
+        # claimed 20 min ago, 10 min of lease left
+        processor.backlog_claimed_at = time.monotonic() - 1200
+        released = await processor._release_expiring_backlog()
+        await asyncio.sleep(0.01)
+        return released, await db.claim_messages(1, "another-worker", 1800)
+
+    released, claimed = asyncio.run(run())
+    assert released
+    assert not processor.backlog
+    assert [m.msg_id for m in claimed] == ["1"]
+
+
+def test_messages_being_processed_arent_added_to_the_backlog_again():
+    db = InMemory()
+    processor = CronProcessor(db, FakePlatform(), engine=None)
+
+    async def run():
+        await db.insert_messages([mention(1, "https://youtu.be/v0000000001")])
+        claimed = await db.claim_messages(1, processor.worker_id, -1)
+        processor.processing[claimed[0].id] = claimed[0]
+        return await processor._fill_backlog()
+
+    assert asyncio.run(run())
+    assert not processor.backlog
+
+
+class LongVideoEngine:
+    # Every video is long, and chaptering one takes chapters_sec or, if it's
+    # set, until release is.
+    def __init__(self, chapters_sec=0.0):
+        self.chapters_sec = chapters_sec
+        self.release = None
+        self.started = []
+
+    def is_long_video(self, end):
+        return True
+
+    async def get_transcript_async(self, video_id, deadline):
+        self.started.append(video_id)
+        return [], 3 * 3600
+
+    async def get_chapters_async(self, video_id, windows, end, deadline):
+        if self.release is not None:
+            await self.release.wait()
+        await asyncio.sleep(self.chapters_sec)
+        return f"0:00 - {video_id}"
+
+
+def test_wait_for_the_long_videos_pool_doesnt_count_in_the_deadline(monkeypatch):
+    monkeypatch.setenv("MESSAGE_DEADLINE_SEC", "1")
+    monkeypatch.setenv("LONG_VIDEO_MAX_JOBS", "1")
+    processor = CronProcessor(
+        InMemory(), platform=None, engine=LongVideoEngine(chapters_sec=0.6)
+    )
+
+    async def run():
+        # the second one waits ~0.6s for the pool, then runs ~0.6s
+        return await asyncio.gather(
+            processor._create_timestamps("v0000000001"),
+            processor._create_timestamps("v0000000002"),
+        )
+
+    assert asyncio.run(run()) == ["0:00 - v0000000001", "0:00 - v0000000002"]
+
+
+def test_long_videos_beyond_the_cap_keep_their_slot(monkeypatch):
+    monkeypatch.setenv("MAX_PARALLEL_MESSAGES", "1")
+    monkeypatch.setenv("LONG_VIDEO_MAX_JOBS", "1")
+    db = InMemory()
+    engine = LongVideoEngine()
+    processor = CronProcessor(db, FakePlatform(reply_latency=0), engine)
+
+    async def run():
+        engine.release = asyncio.Event()
+        await db.insert_messages(
+            [
+                mention(i, f"@TimeStampBuddy https://youtu.be/v000000000{i}")
+                for i in range(1, 6)
+            ]
+        )
+        task = asyncio.create_task(processor.run_data_processor())
+        await asyncio.sleep(0.3)
+        started = len(engine.started)
+        engine.release.set()
+        await asyncio.sleep(0.3)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return started
+
+    # 1 slot, plus 2 long videos given their slot back
+    assert asyncio.run(run()) == 3
+    assert len(engine.started) == 5
+
+
+class FailingReplies(FakePlatform):
+    # The replies to the message ids in `errors` raise the given error once.
+    def __init__(self, errors):
+        super().__init__(reply_latency=0)
+        self.errors = errors
+
+    async def reply(self, text, platform_message_id):
+        error = self.errors.pop(str(platform_message_id), None)
+        if error is not None:
+            raise error
+        await super().reply(text, platform_message_id)
+
+
+class TooManyRequests(Exception):
+    code = 429
+
+
+def test_failed_replies_get_their_own_status_and_429s_are_answered_again():
+    db = InMemory()
+    platform = FailingReplies({"2": TooManyRequests(), "3": ConnectionError()})
+    processor = CronProcessor(db, platform, engine=None)
+
+    async def run():
+        await db.insert_messages([mention(i, "") for i in range(1, 4)])
+        messages = await db.claim_messages(3, processor.worker_id, 60)
+        await asyncio.gather(*(processor._reply(m, "0:00 - Intro") for m in messages))
+        await processor.status_buffer.flush()
+
+    asyncio.run(run())
+    assert [m.status for m in db.messages.values()] == [
+        Status.answered.value,
+        Status.empty.value,
+        Status.failed_reply.value,
+    ]
+    assert sorted(platform.replies) == ["1"]
@@ -0,0 +1,80 @@
+import asyncio
+import time
+
+import pytest
+
+from db import InMemory, SQLite
+from misc import Status, TSBMessage
+
+
+def message(msg_id):
+    return TSBMessage(
+        status=Status.empty.value,
+        msg_text=f"@TimeStampBuddy https://youtu.be/v{msg_id:010d}",
+        msg_from="user",
+        msg_id=str(msg_id),
+    )
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def db(request, tmp_path):
+    if request.param == "memory":
+        return InMemory()
+    return asyncio.run(SQLite.create(str(tmp_path / "test.db")))
+
+
+def test_insert_messages_counts_only_new_messages(db):
+    async def run():
+        first = await db.insert_messages([message(1), message(2)])
+        second = await db.insert_messages([message(2), message(3)])
+        return first, second
+
+    assert asyncio.run(run()) == (2, 1)
+
+
+def claim(db, worker_id, lease_sec=60):
+    return asyncio.run(db.claim_messages(10, worker_id, lease_sec))
+
+
+def test_claimed_messages_arent_claimed_twice(db):
+    asyncio.run(db.insert_messages([message(1), message(2)]))
+    first = claim(db, "a")
+    assert [m.msg_id for m in first] == ["1", "2"]
+    assert all(m.status == Status.process_start.value for m in first)
+    assert claim(db, "b") == []
+
+
+def test_expired_lease_is_claimed_again(db):
+    asyncio.run(db.insert_messages([message(1)]))
+    claim(db, "a", lease_sec=-1)
+    assert [m.msg_id for m in claim(db, "b")] == ["1"]
+
+
+def test_extended_lease_isnt_claimed_again(db):
+    asyncio.run(db.insert_messages([message(1)]))
+    claimed = claim(db, "a", lease_sec=-1)
+    asyncio.run(db.extend_lease(claimed, "a", 60))
+    assert claim(db, "b") == []
+
+
+def test_only_the_owner_extends_the_lease(db):
+    asyncio.run(db.insert_messages([message(1)]))
+    claimed = claim(db, "a", lease_sec=-1)
+    asyncio.run(db.extend_lease(claimed, "b", 60))
+    assert [m.msg_id for m in claim(db, "b")] == ["1"]
+
+
+def test_released_lease_is_claimed_again(db):
+    asyncio.run(db.insert_messages([message(1)]))
+    claimed = claim(db, "a")
+    asyncio.run(db.extend_lease(claimed, "a", 0))
+    time.sleep(0.01)
+    assert [m.msg_id for m in claim(db, "b")] == ["1"]
+
+
+def test_finished_messages_arent_claimed_again(db):
+    asyncio.run(db.insert_messages([message(1), message(2)]))
+    claimed = claim(db, "a", lease_sec=-1)
+    asyncio.run(db.update_many(claimed[:1], Status.process_end))
+    asyncio.run(db.extend_lease(claimed, "a", -1))
+    assert [m.msg_id for m in claim(db, "b")] == ["2"]
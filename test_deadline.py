@@ -0,0 +1,139 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import deadline
+from deadline import DeadlineExceeded, call_timeout, hedged, retry, time_left
+
+
+class Flaky:
+    # Fails the first `failures` calls with `error`.
+    def __init__(self, failures, error=ValueError):
+        self.failures = failures
+        self.error = error
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error(f"call {self.calls}")
+        return "ok"
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    # the delays retry() would have slept
+    delays = []
+    monkeypatch.setattr(deadline.time, "sleep", delays.append)
+    return delays
+
+
+def test_time_left_and_call_timeout():
+    assert time_left(None) is None
+    assert call_timeout(10, None) == 10
+    assert call_timeout(10, time.time() + 2) <= 2
+    with pytest.raises(DeadlineExceeded):
+        time_left(time.time() - 1)
+
+
+def test_retry_backs_off_with_jitter(sleeps, monkeypatch):
+    monkeypatch.setenv("RETRY_ATTEMPTS", "4")
+    call = Flaky(failures=3)
+    assert retry("test", call) == "ok"
+    assert call.calls == 4
+    # 1s, 2s, 4s, each jittered by +-50%
+    for delay, base in zip(sleeps, [1, 2, 4]):
+        assert 0.5 * base <= delay <= 1.5 * base
+    assert len(sleeps) == 3
+
+
+def test_retry_gives_up_after_the_attempts(sleeps, monkeypatch):
+    monkeypatch.setenv("RETRY_ATTEMPTS", "2")
+    call = Flaky(failures=5)
+    with pytest.raises(ValueError):
+        retry("test", call)
+    assert call.calls == 2
+
+
+def test_retry_doesnt_retry_permanent_errors(sleeps):
+    call = Flaky(failures=1, error=KeyError)
+    with pytest.raises(KeyError):
+        retry("test", call, permanent=(KeyError,))
+    assert call.calls == 1
+    assert sleeps == []
+
+
+def test_retry_doesnt_sleep_past_the_deadline(sleeps):
+    call = Flaky(failures=1)
+    # the first delay is at least 0.5s
+    with pytest.raises(ValueError):
+        retry("test", call, deadline=time.time() + 0.2)
+    assert call.calls == 1
+    assert sleeps == []
+
+
+def test_hedged_returns_the_first_success():
+    release = threading.Event()
+
+    def slow():
+        release.wait(5)
+        return "slow"
+
+    with ThreadPoolExecutor(2) as executor:
+        started = time.monotonic()
+        result = hedged(executor, [slow, lambda: "fast"], hedge_after=0.05)
+        release.set()
+    assert result == "fast"
+    assert time.monotonic() - started < 1
+
+
+def test_hedged_hedges_right_away_after_a_failure():
+    def fail():
+        raise ValueError()
+
+    with ThreadPoolExecutor(2) as executor:
+        started = time.monotonic()
+        assert hedged(executor, [fail, lambda: "ok"], hedge_after=5) == "ok"
+    assert time.monotonic() - started < 1
+
+
+def test_hedged_raises_permanent_errors_without_hedging():
+    calls = []
+
+    def fail():
+        calls.append("first")
+        raise KeyError()
+
+    def second():
+        calls.append("second")
+        return "ok"
+
+    with ThreadPoolExecutor(2) as executor:
+        with pytest.raises(KeyError):
+            hedged(executor, [fail, second], hedge_after=5, permanent=(KeyError,))
+    assert calls == ["first"]
+
+
+def test_hedged_raises_the_last_error_when_all_fail():
+    def fail():
+        raise ValueError()
+
+    with ThreadPoolExecutor(2) as executor:
+        with pytest.raises(ValueError):
+            hedged(executor, [fail, fail], hedge_after=0.01)
+
+
+def test_hedged_stops_waiting_at_the_deadline():
+    release = threading.Event()
+
+    with ThreadPoolExecutor(1) as executor:
+        with pytest.raises(DeadlineExceeded):
+            hedged(
+                executor,
+                [lambda: release.wait(5)],
+                hedge_after=5,
+                deadline=time.time() + 0.05,
+            )
+        release.set()
@@ -0,0 +1,159 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import rate_limit
+from deadline import DeadlineExceeded
+from rate_limit import (
+    RateLimiter,
+    get_limiter,
+    get_retry_after,
+    is_rate_limited,
+    is_timeout,
+)
+
+
+class RateLimitError(Exception):
+    code = 429
+
+    def __init__(self, retry_after):
+        super().__init__("429")
+        self.response = SimpleNamespace(headers={"Retry-After": str(retry_after)})
+
+
+def test_aslot_is_released_when_the_caller_is_cancelled():
+    limiter = RateLimiter("test", max_concurrency=1)
+
+    async def hang():
+        async with limiter.aslot():
+            await asyncio.sleep(3600)
+
+    async def run():
+        task = asyncio.create_task(hang())
+        await asyncio.sleep(0)
+        assert limiter.in_flight == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # the next call gets the only slot
+        await asyncio.wait_for(limiter.acquire_async(), 1)
+
+    asyncio.run(run())
+    assert limiter.concurrency == 1
+
+
+def test_slot_is_released_on_errors():
+    limiter = RateLimiter("test", max_concurrency=2)
+    with pytest.raises(ValueError):
+        with limiter.slot():
+            raise ValueError()
+    assert limiter.in_flight == 0
+    # not a sign of congestion
+    assert limiter.concurrency == 2
+
+
+def test_rate_limit_halves_the_concurrency_and_blocks():
+    limiter = RateLimiter("test", max_concurrency=4)
+    with pytest.raises(RateLimitError):
+        with limiter.slot():
+            raise RateLimitError(retry_after=30)
+    assert limiter.in_flight == 0
+    assert limiter.concurrency == 2
+    assert limiter._reserve(0) > 25
+
+
+def test_timeouts_halve_the_concurrency():
+    limiter = RateLimiter("test", max_concurrency=4)
+    with pytest.raises(TimeoutError):
+        with limiter.slot():
+            raise TimeoutError()
+    assert limiter.concurrency == 2
+
+
+def test_slow_calls_dont_decrease_the_concurrency():
+    limiter = RateLimiter("test", max_concurrency=4)
+    limiter.concurrency = 2
+
+    async def call(sec):
+        async with limiter.aslot():
+            await asyncio.sleep(sec)
+
+    async def run():
+        for _ in range(3):
+            await call(0)
+        await call(0.05)
+
+    asyncio.run(run())
+    assert limiter.concurrency > 2
+
+
+def test_error_classification():
+    assert is_rate_limited(RateLimitError(1))
+    assert get_retry_after(RateLimitError(7)) == 7
+    assert not is_rate_limited(ValueError())
+    assert is_timeout(TimeoutError())
+    assert is_timeout(type("ReadTimeout", (Exception,), {})())
+    assert not is_timeout(DeadlineExceeded())
+
+
+def test_aslot_is_released_when_the_caller_is_cancelled_while_waiting():
+    limiter = RateLimiter("test", rpm=1, max_concurrency=1)
+
+    async def call():
+        async with limiter.aslot():
+            pass
+
+    async def run():
+        await call()
+        # waits ~60s for the next request of the minute
+        task = asyncio.create_task(call())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    assert limiter.in_flight == 0
+
+
+def test_calls_waiting_for_their_budget_dont_hold_a_slot():
+    limiter = RateLimiter("test", max_concurrency=1)
+    limiter.blocked_until = time.monotonic() + 60
+
+    async def run():
+        task = asyncio.create_task(limiter.acquire_async())
+        await asyncio.sleep(0.01)
+        assert limiter.in_flight == 0
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    assert limiter.in_flight == 0
+
+
+def test_a_429_pauses_the_callers_already_waiting_for_their_budget():
+    limiter = RateLimiter("test", max_concurrency=2)
+    limiter.blocked_until = time.monotonic() + 0.2
+
+    async def run():
+        # waits ~0.2s, then the server asks for 30s more
+        task = asyncio.create_task(limiter.acquire_async())
+        await asyncio.sleep(0.01)
+        limiter.on_error(RateLimitError(retry_after=30))
+        await asyncio.sleep(0.5)
+        assert limiter.in_flight == 0
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+
+
+def test_x_endpoints_have_their_own_limiters(monkeypatch):
+    monkeypatch.setattr(rate_limit, "_limiters", {})
+    assert get_limiter("x_reply") is not get_limiter("x_mentions")
+    get_limiter("x_reply").on_error(RateLimitError(retry_after=6 * 3600))
+    assert get_limiter("x_mentions")._reserve(0) == 0
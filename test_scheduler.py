@@ -0,0 +1,55 @@
+from misc import Status, TSBMessage
+from scheduler import Scheduler
+
+
+def message(msg_id, msg_from):
+    return TSBMessage(
+        status=Status.process_start.value,
+        msg_text="",
+        msg_from=msg_from,
+        msg_id=str(msg_id),
+        id=msg_id,
+    )
+
+
+def video_ids(groups):
+    return [video_id for video_id, _ in groups]
+
+
+def test_take_is_round_robin_across_users():
+    scheduler = Scheduler()
+    for i in range(1, 4):
+        scheduler.add(f"spam{i}", message(i, "spammer"))
+    scheduler.add("a", message(4, "alice"))
+    scheduler.add("b", message(5, "bob"))
+    assert video_ids(scheduler.take(3)) == ["spam1", "a", "b"]
+    assert video_ids(scheduler.take(5)) == ["spam2", "spam3"]
+    assert not scheduler
+    assert scheduler.take(1) == []
+
+
+def test_video_is_taken_once_with_the_messages_of_all_users():
+    scheduler = Scheduler()
+    scheduler.add("shared", message(1, "alice"))
+    scheduler.add("other", message(2, "alice"))
+    scheduler.add("shared", message(3, "bob"))
+    assert scheduler.message_count() == 3
+    groups = scheduler.take(1)
+    assert [(video_id, [m.id for m in messages]) for video_id, messages in groups] == [
+        ("shared", [1, 3])
+    ]
+    # bob's turn, but his only video was already taken
+    assert video_ids(scheduler.take(2)) == ["other"]
+
+
+def test_take_ready_takes_only_the_ready_videos():
+    scheduler = Scheduler()
+    scheduler.add("cached", message(1, "alice"))
+    scheduler.add("new", message(2, "alice"))
+    scheduler.add("cached", message(3, "bob"))
+    groups = scheduler.take_ready(lambda video_id: video_id == "cached")
+    assert [(video_id, len(messages)) for video_id, messages in groups] == [
+        ("cached", 2)
+    ]
+    assert len(scheduler) == 1
+    assert video_ids(scheduler.take(2)) == ["new"]
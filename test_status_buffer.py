@@ -0,0 +1,87 @@
+import asyncio
+
+from db import InMemory
+from misc import Status, TSBMessage
+from status_buffer import StatusBuffer
+
+
+class FlakyDB(InMemory):
+    # update_many fails `failures` times, and records the batches written.
+    def __init__(self, failures=0):
+        super().__init__()
+        self.failures = failures
+        self.batches = []
+
+    async def update_many(self, messages, status):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("db unavailable")
+        self.batches.append((status, sorted(m.id for m in messages)))
+        await super().update_many(messages, status)
+
+
+def message(msg_id):
+    return TSBMessage(
+        status=Status.process_start.value,
+        msg_text="",
+        msg_from="user",
+        msg_id=str(msg_id),
+        id=msg_id,
+    )
+
+
+def test_flush_writes_one_batch_per_status_with_the_last_status():
+    db = FlakyDB()
+    buffer = StatusBuffer(db, flush_interval=60, max_batch=100)
+    buffer.set(message(1), Status.failed_timestamps)
+    buffer.set(message(2), Status.answered)
+    buffer.set(message(1), Status.answered)
+    buffer.set(message(3), Status.invalid)
+    asyncio.run(buffer.flush())
+    assert dict(db.batches) == {
+        Status.answered: [1, 2],
+        Status.invalid: [3],
+    }
+    assert not buffer.pending
+
+
+def test_failed_flush_is_retried():
+    db = FlakyDB(failures=1)
+    buffer = StatusBuffer(db, flush_interval=60, max_batch=100)
+    buffer.set(message(1), Status.answered)
+    asyncio.run(buffer.flush())
+    assert db.batches == []
+    assert list(buffer.pending) == [1]
+    asyncio.run(buffer.flush())
+    assert db.batches == [(Status.answered, [1])]
+
+
+def test_failed_flush_doesnt_overwrite_a_newer_status():
+    db = FlakyDB(failures=1)
+    buffer = StatusBuffer(db, flush_interval=60, max_batch=100)
+
+    async def update_many(messages, status):
+        # a newer status is set while the flush is in progress
+        buffer.set(message(1), Status.invalid)
+        raise ConnectionError("db unavailable")
+
+    db.update_many = update_many
+    buffer.set(message(1), Status.answered)
+    asyncio.run(buffer.flush())
+    assert buffer.pending[1][1] == Status.invalid
+
+
+def test_run_flushes_early_when_max_batch_is_reached():
+    db = FlakyDB()
+    buffer = StatusBuffer(db, flush_interval=60, max_batch=2)
+
+    async def run():
+        task = asyncio.create_task(buffer.run())
+        await asyncio.sleep(0)
+        buffer.set(message(1), Status.answered)
+        buffer.set(message(2), Status.answered)
+        await asyncio.sleep(0.05)
+        task.cancel()
+
+    asyncio.run(run())
+    assert db.batches == [(Status.answered, [1, 2])]
@@ -0,0 +1,75 @@
+import os
+import random
+import time
+
+import pytest
+
+from transcript_cache import TranscriptCache
+
+TRANSCRIPT = [{"text": "hello", "start": 0.0, "duration": 1.5}]
+
+
+def noise(count):
+    # doesn't compress, so each transcript takes about the same size on disk
+    return [{"text": f"{random.getrandbits(64):x}"} for _ in range(count)]
+
+
+def test_get_returns_the_first_cached_language(tmp_path):
+    cache = TranscriptCache(str(tmp_path), max_bytes=1 << 20)
+    assert cache.get("v1", ["en"]) is None
+    cache.set("v1", "de", TRANSCRIPT)
+    cache.set("v1", "fr", [{"text": "bonjour"}])
+    assert cache.get("v1", ["en", "fr", "de"]) == ("fr", [{"text": "bonjour"}])
+    # a new instance reads the same files
+    assert TranscriptCache(str(tmp_path), 1 << 20).get("v1", ["de"]) == (
+        "de",
+        TRANSCRIPT,
+    )
+
+
+def test_set_is_atomic(tmp_path, monkeypatch):
+    cache = TranscriptCache(str(tmp_path), max_bytes=1 << 20)
+    cache.set("v1", "en", TRANSCRIPT)
+
+    def fail(*args):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(os, "replace", fail)
+    with pytest.raises(OSError):
+        cache.set("v1", "en", [{"text": "new"}])
+    # the old file is intact and no temporary file is left behind
+    assert cache.get("v1", ["en"]) == ("en", TRANSCRIPT)
+    assert sorted(os.listdir(tmp_path)) == ["v1.en.json.gz"]
+
+
+def test_broken_file_is_ignored(tmp_path):
+    cache = TranscriptCache(str(tmp_path), max_bytes=1 << 20)
+    (tmp_path / "v1.en.json.gz").write_bytes(b"not gzip")
+    cache.set("v1", "de", TRANSCRIPT)
+    assert cache.get("v1", ["en", "de"]) == ("de", TRANSCRIPT)
+
+
+def test_least_recently_used_files_are_evicted(tmp_path):
+    cache = TranscriptCache(str(tmp_path), max_bytes=1 << 20)
+    cache.set("v1", "en", noise(200))
+    size = cache._size
+    cache.max_bytes = int(size * 2.5)
+    cache.set("v2", "en", noise(200))
+    # v1 is used after v2, so v2 is the least recently used
+    past = time.time() - 60
+    os.utime(tmp_path / "v1.en.json.gz", (past, past))
+    os.utime(tmp_path / "v2.en.json.gz", (past - 60, past - 60))
+    assert cache.get("v1", ["en"]) is not None
+    cache.set("v3", "en", noise(200))
+    assert cache.get("v2", ["en"]) is None
+    assert cache.get("v1", ["en"]) is not None
+    assert cache.get("v3", ["en"]) is not None
+    assert cache._size <= cache.max_bytes
+
+
+def test_disabled_with_max_bytes_0(monkeypatch, tmp_path):
+    monkeypatch.setenv("TRANSCRIPT_CACHE_MAX_BYTES", "0")
+    assert TranscriptCache.from_env() is None
+    monkeypatch.setenv("TRANSCRIPT_CACHE_MAX_BYTES", "1000")
+    monkeypatch.setenv("TRANSCRIPT_CACHE_DIR", str(tmp_path / "cache"))
+    assert TranscriptCache.from_env().max_bytes == 1000
@@ -0,0 +1,56 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+class TrafficLog:
+    # Records what happens to the traffic (the mentions, the transcript and
+    # Gemini calls with their latencies, the replies) as JSON lines appended to
+    # TRAFFIC_LOG_FILE, to be turned into a trace by benchmarks/replay.py and
+    # replayed offline. Disabled (nothing is written) when TRAFFIC_LOG_FILE is
+    # empty, the default. The file is opened for each event, so the executor
+    # threads and the worker processes (TIMESTAMPS_EXECUTOR=process) can all
+    # append to it: each event is written with a single write.
+    def __init__(self):
+        self._path = None
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        # read on first use, also in the worker processes
+        if self._path is None:
+            self._path = os.environ.get("TRAFFIC_LOG_FILE", "")
+        return self._path
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def record(self, event, **fields):
+        if not self.path:
+            return
+        line = json.dumps({"event": event, "t": round(time.time(), 3), **fields})
+        try:
+            with self._lock, open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except Exception as e:
+            logging.error(f"Error when writing to the traffic log. {e}")
+
+    @contextmanager
+    def timed(self, event, **fields):
+        # Records the event with how long the block took and whether it raised.
+        started = time.monotonic()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.record(
+                event, sec=round(time.monotonic() - started, 3), ok=ok, **fields
+            )
+
+
+traffic_log = TrafficLog()
@@ -0,0 +1,51 @@
+import json
+from typing import Dict, List, Tuple
+
+Window = Tuple[int, str]
+
+
+def merge_segments(data: List[Dict], window_sec: int) -> List[Window]:
+    # Caption segments are only a few seconds long. Merging them into windows of
+    # about window_sec seconds keeps enough precision for chapters and removes
+    # most of the per-segment overhead.
+    windows = []
+    start, texts = None, []
+    for item in data:
+        text = " ".join(item["text"].split())
+        if not text:
+            continue
+        if start is None:
+            start = int(item["start"])
+        elif item["start"] - start >= window_sec:
+            windows.append((start, " ".join(texts)))
+            start, texts = int(item["start"]), []
+        texts.append(text)
+    if texts:
+        windows.append((start, " ".join(texts)))
+    return windows
+
+
+def split_windows(windows: List[Window], chunk_sec: int) -> List[List[Window]]:
+    # Splits the windows in time ordered chunks of about chunk_sec seconds each.
+    chunks = []
+    for window in windows:
+        if not chunks or window[0] - chunks[-1][0][0] >= chunk_sec:
+            chunks.append([])
+        chunks[-1].append(window)
+    return chunks
+
+
+def encode_windows(windows: List[Window]) -> str:
+    # [[start_second, "text"], ...] without any indentation or extra spaces.
+    return json.dumps(
+        [[start, text] for start, text in windows],
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+
+
+def transcript_end(data: List[Dict]) -> int:
+    if not data:
+        return 0
+    last = data[-1]
+    return int(last["start"] + last.get("duration", 0))
@@ -0,0 +1,98 @@
+import gzip
+import json
+import logging
+import os
+import tempfile
+import threading
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_TRANSCRIPT_CACHE_DIR = ".transcript_cache"
+DEFAULT_TRANSCRIPT_CACHE_MAX_BYTES = 200 * 1024 * 1024
+
+
+class TranscriptCache:
+    # Transcripts downloaded from YouTube, kept on disk (gzipped JSON) so retries,
+    # a new GEMINI_MODEL or prompt changes don't need to download them again.
+    # One file per (video_id, language). When the files take more than max_bytes,
+    # the least recently used ones are deleted (a cache hit updates the file mtime).
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self._size = sum(size for _, size, _ in self._list_files())
+
+    @classmethod
+    def from_env(cls) -> Optional["TranscriptCache"]:
+        max_bytes = int(
+            os.environ.get(
+                "TRANSCRIPT_CACHE_MAX_BYTES", DEFAULT_TRANSCRIPT_CACHE_MAX_BYTES
+            )
+        )
+        if max_bytes <= 0:
+            return None
+        path = os.environ.get("TRANSCRIPT_CACHE_DIR", DEFAULT_TRANSCRIPT_CACHE_DIR)
+        return cls(path, max_bytes)
+
+    def _file(self, video_id: str, language: str) -> str:
+        return os.path.join(self.path, f"{video_id}.{language}.json.gz")
+
+    def _list_files(self):
+        files = []
+        for entry in os.scandir(self.path):
+            if entry.is_file() and entry.name.endswith(".json.gz"):
+                stat = entry.stat()
+                files.append((entry.path, stat.st_size, stat.st_mtime))
+        return files
+
+    def get(
+        self, video_id: str, languages: List[str]
+    ) -> Optional[Tuple[str, List[Dict]]]:
+        # Returns (language, transcript) for the first language of the list
+        # that is cached, the same priority used when downloading.
+        for language in languages:
+            file = self._file(video_id, language)
+            try:
+                with gzip.open(file, "rt", encoding="utf-8") as f:
+                    data = json.load(f)
+                os.utime(file)
+            except FileNotFoundError:
+                continue
+            except (OSError, ValueError) as e:
+                logging.warning(f"{video_id} - Ignoring broken cached transcript. {e}")
+                continue
+            return language, data
+        return None
+
+    def set(self, video_id: str, language: str, data: List[Dict]) -> None:
+        file = self._file(video_id, language)
+        fd, tmp_file = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as raw, gzip.GzipFile(
+                fileobj=raw, mode="wb"
+            ) as f:
+                f.write(json.dumps(data, separators=(",", ":")).encode("utf-8"))
+            size = os.path.getsize(tmp_file)
+            with self._lock:
+                if os.path.exists(file):
+                    self._size -= os.path.getsize(file)
+                os.replace(tmp_file, file)
+                self._size += size
+                if self._size > self.max_bytes:
+                    self._evict()
+        except BaseException:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            raise
+
+    def _evict(self):
+        files = sorted(self._list_files(), key=lambda f: f[2])
+        self._size = sum(size for _, size, _ in files)
+        for file, size, _ in files:
+            if self._size <= self.max_bytes:
+                break
+            try:
+                os.remove(file)
+            except FileNotFoundError:
+                pass
+            self._size -= size
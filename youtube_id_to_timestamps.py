@@ -1,109 +1,596 @@
-from youtube_transcript_api import YouTubeTranscriptApi
-import json
-from datetime import timedelta
+import asyncio
+import functools
+import itertools
 import os
+import threading
 import time
-import google.generativeai as genai
 import tempfile
-import json
+from types import SimpleNamespace
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import logging
+from chapters import fit_chapters, parse_chapters
+from deadline import (
+    DeadlineExceeded,
+    LatencyTracker,
+    call_timeout,
+    hedged,
+    retry,
+    time_left,
+)
+from metrics import metrics
+from rate_limit import get_limiter
+from traffic_log import traffic_log
+from transcript_cache import TranscriptCache
+from transcript import encode_windows, merge_segments, split_windows, transcript_end
 
 DEFAULT_GEMINI_MODEL = "gemini-2.0-flash-exp"
+DEFAULT_TIMESTAMPS_WORKERS = 4
+DEFAULT_TIMESTAMPS_EXECUTOR = "thread"
+TRANSCRIPT_LANGUAGES = ['en', 'es', 'pt', 'pt-PT', 'de', 'it', 'zh-Hant', 'zh-Hans', 'ja', 'ro', 'vi', 'fr']
+DEFAULT_TRANSCRIPT_WINDOW_SEC = 30
+DEFAULT_INLINE_TRANSCRIPT_MAX_CHARS = 1_000_000
+DEFAULT_LONG_VIDEO_SEC = 60 * 60 * 2
+DEFAULT_LONG_VIDEO_CHUNK_SEC = 60 * 45
+DEFAULT_LONG_VIDEO_CONCURRENCY = 3
+DEFAULT_TRANSCRIPT_TIMEOUT_SEC = 30
+DEFAULT_TRANSCRIPT_HEDGE_AFTER_SEC = 10
+DEFAULT_GEMINI_TIMEOUT_SEC = 120
+# Rough length of a "H:MM:SS - title" line, used to estimate how many chapters fit.
+AVG_CHAPTER_LINE_LENGTH = 40
+
+
+class TranscriptUnavailable(Exception):
+    # The video has no usable transcript (disabled, missing, private or invalid id),
+    # so retrying it soon would fail the same way.
+    pass
+
+
+# The SDKs below take a while to import (google.generativeai alone ~1.5s), so
+# they are imported on first use: the collector can start polling right after
+# a restart, before the first video needs them.
+
+
+@functools.lru_cache(maxsize=None)
+def _genai():
+    import google.generativeai as genai
+
+    return genai
+
+
+@functools.lru_cache(maxsize=None)
+def _youtube():
+    import requests
+    from requests.adapters import HTTPAdapter
+    from youtube_transcript_api import (
+        YouTubeTranscriptApi,
+        TranscriptsDisabled,
+        NoTranscriptFound,
+        VideoUnavailable,
+        InvalidVideoId,
+    )
+
+    class TimeoutAdapter(HTTPAdapter):
+        # youtube-transcript-api doesn't pass a timeout to the session, so the
+        # adapter adds one. Set before each request (sessions are per thread).
+        timeout = DEFAULT_TRANSCRIPT_TIMEOUT_SEC
+
+        def send(self, request, **kwargs):
+            if kwargs.get("timeout") is None:
+                kwargs["timeout"] = self.timeout
+            return super().send(request, **kwargs)
+
+    return SimpleNamespace(
+        requests=requests,
+        TimeoutAdapter=TimeoutAdapter,
+        YouTubeTranscriptApi=YouTubeTranscriptApi,
+        # the video has no usable transcript
+        unavailable_errors=(
+            TranscriptsDisabled,
+            NoTranscriptFound,
+            VideoUnavailable,
+            InvalidVideoId,
+        ),
+    )
+
+
+_worker_engine = None
+
+
+def _get_worker_engine(max_response_length):
+    # For process pools: the instance (and genai's global config) has to be
+    # built inside the worker process, once per process.
+    global _worker_engine
+    if _worker_engine is None:
+        _worker_engine = YoutubeIdToTimestamps(
+            max_response_length, create_executor=False
+        )
+    return _worker_engine
+
+
+def _get_transcript_in_worker(max_response_length, youtube_id, deadline):
+    return _get_worker_engine(max_response_length).get_transcript(
+        youtube_id, deadline
+    )
+
+
+def _get_chapters_in_worker(max_response_length, youtube_id, windows, end, deadline):
+    return _get_worker_engine(max_response_length).get_chapters(
+        youtube_id, windows, end, deadline
+    )
+
+
+def _estimate_tokens(transcript):
+    # About 4 characters per token. Uploaded files only expose their size.
+    if isinstance(transcript, str):
+        return len(transcript) // 4
+    return getattr(transcript, "size_bytes", 0) // 4
 
 
 class YoutubeIdToTimestamps:
-    def __init__(self, max_response_length):
-        genai.configure(api_key=os.environ.get("GEMINI_API_KEY", ""))
-        pr = os.environ.get("YT_TRANSCRIPT_PROXY", "")
-        self.proxies = None
-        if pr:
-            self.proxies = {
-                "https": pr.replace("http://", "https://"),
-                "http": pr.replace("https://", "http://"),
-            }
+    # Meant to be created once per process and shared: it keeps the configured
+    # Gemini models, the worker pool and one pooled HTTP session per worker thread
+    # for the transcript requests. Settings are read again from the env before
+    # each video, and everything is rebuilt only if they changed.
+    def __init__(self, max_response_length, create_executor=True):
         self.max_response_length = max_response_length
+        self.executor = self._create_executor() if create_executor else None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._settings = None
+        self._generation = 0
+        self._models = {}
+        self._genai_generation = None
+        self.transcript_cache = TranscriptCache.from_env()
+        self.transcript_latency = LatencyTracker()
+        self._hedge_executor = None
+        self._next_proxy = itertools.count()
+        self.reload()
+
+    def _create_executor(self):
+        workers = int(
+            os.environ.get("TIMESTAMPS_WORKERS", DEFAULT_TIMESTAMPS_WORKERS)
+        )
+        kind = os.environ.get("TIMESTAMPS_EXECUTOR", DEFAULT_TIMESTAMPS_EXECUTOR)
+        if kind == "process":
+            return ProcessPoolExecutor(max_workers=workers)
+        return ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="timestamps"
+        )
+
+    def _read_settings(self):
+        return (
+            os.environ.get("GEMINI_API_KEY", ""),
+            os.environ.get("GEMINI_MODEL", DEFAULT_GEMINI_MODEL),
+            os.environ.get("YT_TRANSCRIPT_PROXY", ""),
+        )
+
+    def reload(self):
+        settings = self._read_settings()
+        with self._lock:
+            if settings == self._settings:
+                return
+            self.api_key, self.model_name, pr = settings
+            # YT_TRANSCRIPT_PROXY can be a comma separated list: the requests
+            # rotate over them, and a slow request is hedged through another one.
+            self.proxy_pool = [
+                {
+                    "https": proxy.replace("http://", "https://"),
+                    "http": proxy.replace("https://", "http://"),
+                }
+                for proxy in (p.strip() for p in pr.split(","))
+                if proxy
+            ] or [None]
+            self._models = {}
+            self._settings = settings
+            # The per thread sessions check this to know they are outdated.
+            self._generation += 1
+
+    def preload(self):
+        # Imports the SDKs ahead of the first video, e.g. from a background thread.
+        self._get_genai()
+        _youtube()
+
+    def _get_genai(self):
+        genai = _genai()
+        with self._lock:
+            if self._genai_generation != self._generation:
+                genai.configure(api_key=self.api_key)
+                self._genai_generation = self._generation
+        return genai
 
-    def _seconds_to_hhmmss(self, seconds):
-        td = timedelta(seconds=round(seconds))
-        return str(td)
+    def _get_http_session(self, proxy_index=0):
+        # One session per thread and per proxy of the pool.
+        local = self._local
+        if getattr(local, "generation", None) != self._generation:
+            for client in getattr(local, "clients", {}).values():
+                client.session.close()
+            local.clients = {}
+            local.generation = self._generation
+        client = local.clients.get(proxy_index)
+        if client is None:
+            client = local.clients[proxy_index] = SimpleNamespace()
+            youtube = _youtube()
+            session = youtube.requests.Session()
+            client.adapter = youtube.TimeoutAdapter(pool_connections=4, pool_maxsize=4)
+            session.mount("http://", client.adapter)
+            session.mount("https://", client.adapter)
+            proxies = self.proxy_pool[proxy_index]
+            if proxies:
+                session.proxies.update(proxies)
+            client.session = session
+            client.transcript_api = None
+            if hasattr(youtube.YouTubeTranscriptApi, "fetch"):
+                # youtube-transcript-api >= 1.0 accepts the session to use.
+                client.transcript_api = youtube.YouTubeTranscriptApi(
+                    http_client=session
+                )
+        return client
+
+    def _fetch_transcript(self, youtube_id, proxy_index=0, deadline=None):
+        # Returns (language, transcript)
+        timeout = call_timeout(
+            float(
+                os.environ.get("TRANSCRIPT_TIMEOUT_SEC", DEFAULT_TRANSCRIPT_TIMEOUT_SEC)
+            ),
+            deadline,
+        )
+        with get_limiter("youtube").slot(), metrics.span(
+            "transcript_fetch"
+        ), traffic_log.timed("transcript_fetch", video=youtube_id):
+            started = time.monotonic()
+            client = self._get_http_session(proxy_index)
+            if client.transcript_api is not None:
+                client.adapter.timeout = timeout
+                fetched = client.transcript_api.fetch(
+                    youtube_id, languages=TRANSCRIPT_LANGUAGES
+                )
+                result = fetched.language_code, fetched.to_raw_data()
+            else:
+                transcript = _youtube().YouTubeTranscriptApi.list_transcripts(
+                    youtube_id, proxies=self.proxy_pool[proxy_index]
+                ).find_transcript(TRANSCRIPT_LANGUAGES)
+                result = transcript.language_code, transcript.fetch()
+        self.transcript_latency.add(time.monotonic() - started)
+        return result
+
+    def _get_hedge_executor(self):
+        with self._lock:
+            if self._hedge_executor is None:
+                workers = int(
+                    os.environ.get("TIMESTAMPS_WORKERS", DEFAULT_TIMESTAMPS_WORKERS)
+                )
+                self._hedge_executor = ThreadPoolExecutor(
+                    max_workers=workers * 2, thread_name_prefix="hedge"
+                )
+            return self._hedge_executor
+
+    def _fetch_transcript_hedged(self, youtube_id, deadline=None):
+        # With several proxies, a request slower than the usual p95 is sent again
+        # through the next proxy, and the first answer wins.
+        hedge_after = float(
+            os.environ.get(
+                "TRANSCRIPT_HEDGE_AFTER_SEC", DEFAULT_TRANSCRIPT_HEDGE_AFTER_SEC
+            )
+        )
+        pool_size = len(self.proxy_pool)
+        first = next(self._next_proxy) % pool_size
+        if pool_size == 1 or not hedge_after:
+            return self._fetch_transcript(youtube_id, first, deadline)
+        p95 = self.transcript_latency.percentile(95)
+        return hedged(
+            self._get_hedge_executor(),
+            [
+                lambda: self._fetch_transcript(youtube_id, first, deadline),
+                lambda: self._fetch_transcript(
+                    youtube_id, (first + 1) % pool_size, deadline
+                ),
+            ],
+            hedge_after if p95 is None else p95,
+            deadline,
+            permanent=_youtube().unavailable_errors,
+        )
+
+    def _get_transcript(self, youtube_id, deadline=None):
+        if self.transcript_cache is not None:
+            cached = self.transcript_cache.get(youtube_id, TRANSCRIPT_LANGUAGES)
+            if cached is not None:
+                metrics.inc("tsb_cache_requests_total", cache="transcript", result="hit")
+                logging.info(f"{youtube_id} - got the transcript from the cache")
+                return cached[1]
+            metrics.inc("tsb_cache_requests_total", cache="transcript", result="miss")
 
-    def _get_transcript(self, youtube_id):
         logging.info(f"{youtube_id} - making the request to get the transcript")
         #transcript_list = YouTubeTranscriptApi.list_transcripts(youtube_id)
         #transcript = next((item for item in transcript_list if item.get("is_generated")), transcript_list[0])
         #if not transcript:
         #    logging.error("No auto generated transcript found")
-        data = YouTubeTranscriptApi.get_transcript(
-            youtube_id, languages=['en', 'es', 'pt', 'pt-PT', 'de', 'it', 'zh-Hant', 'zh-Hans', 'ja', 'ro', 'vi', 'fr'], proxies=self.proxies
-        )
+        try:
+            language, data = retry(
+                f"{youtube_id} - transcript",
+                lambda: self._fetch_transcript_hedged(youtube_id, deadline),
+                deadline,
+                permanent=_youtube().unavailable_errors,
+            )
+        except _youtube().unavailable_errors as e:
+            raise TranscriptUnavailable(type(e).__name__) from e
         logging.info(f"{youtube_id} - got the transcript. First 5 objs: {data[:5]}")
-        transformed_data = [
-            {"text": item["text"], "start": self._seconds_to_hhmmss(item["start"])}
-            for item in data
+        if self.transcript_cache is not None:
+            try:
+                self.transcript_cache.set(youtube_id, language, data)
+            except Exception as e:
+                logging.error(f"{youtube_id} - Error when caching the transcript. {e}")
+        return data
+
+    def _merge_transcript(self, data):
+        window_sec = int(
+            os.environ.get("TRANSCRIPT_WINDOW_SEC", DEFAULT_TRANSCRIPT_WINDOW_SEC)
+        )
+        return merge_segments(data, window_sec)
+
+    def _get_transcript_part(self, youtube_id, file_content, deadline=None):
+        # Small transcripts go inline in the prompt. Only the big ones are uploaded,
+        # which also means waiting for Gemini to process the file.
+        inline_max_chars = int(
+            os.environ.get(
+                "INLINE_TRANSCRIPT_MAX_CHARS", DEFAULT_INLINE_TRANSCRIPT_MAX_CHARS
+            )
+        )
+        if len(file_content) <= inline_max_chars:
+            logging.info(
+                f"{youtube_id} - Sending the transcript inline - {len(file_content)=}"
+            )
+            return file_content
+
+        files = [
+            retry(
+                f"{youtube_id} - upload",
+                lambda: self._upload_to_gemini(file_content, mime_type="text/plain"),
+                deadline,
+            ),
         ]
-        return json.dumps(transformed_data, indent=4)
+        logging.info(f"{youtube_id} - Will wait for files to be active")
+        with metrics.span("gemini_wait"):
+            self._wait_for_files_active(files, deadline)
+        logging.info(f"{youtube_id} - Files were attached")
+        return files[0]
 
     def _upload_to_gemini(self, file_content, mime_type=None):
         with tempfile.NamedTemporaryFile(
             suffix=".tmp", mode="w+", encoding="utf-8"
         ) as tmpfile:
             tmpfile.write(file_content)
+            tmpfile.flush()
             tmp_path = tmpfile.name
-            file = genai.upload_file(tmp_path, mime_type=mime_type)
+            with get_limiter("gemini").slot(), metrics.span("gemini_upload"):
+                file = self._get_genai().upload_file(tmp_path, mime_type=mime_type)
             return file
 
-    def _wait_for_files_active(self, files):
+    def _wait_for_files_active(self, files, deadline=None):
+        genai = self._get_genai()
         for name in (file.name for file in files):
             file = genai.get_file(name)
+            delay = 1
             while file.state.name == "PROCESSING":
-                time.sleep(10)
+                left = time_left(deadline)
+                time.sleep(delay if left is None else min(delay, left))
+                delay = min(delay * 2, 10)
                 file = genai.get_file(name)
             if file.state.name != "ACTIVE":
                 raise Exception(f"File {file.name} failed to process")
 
-    def get_timestamps(self, youtube_id):
-        file_content = self._get_transcript(youtube_id)
-        model = genai.GenerativeModel(
-            model_name=os.environ.get("GEMINI_MODEL", DEFAULT_GEMINI_MODEL),
-            generation_config={
-                "temperature": 1,
-                "top_p": 0.95,
-                "top_k": 40,
-                "max_output_tokens": 8192,
-                "response_mime_type": "text/plain",
-            },
+    def _get_model(self, response_mime_type="text/plain"):
+        genai = self._get_genai()
+        with self._lock:
+            model = self._models.get(response_mime_type)
+            if model is None:
+                model = genai.GenerativeModel(
+                    model_name=self.model_name,
+                    generation_config={
+                        "temperature": 1,
+                        "top_p": 0.95,
+                        "top_k": 40,
+                        "max_output_tokens": 8192,
+                        "response_mime_type": response_mime_type,
+                    },
+                )
+                self._models[response_mime_type] = model
+            return model
+
+    def _generate(self, youtube_id, model, contents, kind, deadline=None):
+        # One Gemini request, with a timeout and retries within the deadline.
+        # Nothing is kept between the attempts (no chat session), so a failed
+        # attempt can be sent again as it is.
+        tokens = sum(
+            _estimate_tokens(part)
+            for content in contents
+            for part in (content["parts"] if isinstance(content, dict) else [content])
+        )
+        gemini_timeout = float(
+            os.environ.get("GEMINI_TIMEOUT_SEC", DEFAULT_GEMINI_TIMEOUT_SEC)
         )
 
-        files = [
-            self._upload_to_gemini(file_content, mime_type="text/plain"),
-        ]
-        logging.info(f"{youtube_id} - Will wait for files to be active")
-        self._wait_for_files_active(files)
-        logging.info(f"{youtube_id} - Files were attached")
+        def request():
+            timeout = call_timeout(gemini_timeout, deadline)
+            with get_limiter("gemini").slot(tokens=tokens), metrics.span(
+                "llm_request", kind=kind
+            ), traffic_log.timed(
+                "llm_request", video=youtube_id, kind=kind, tokens=tokens
+            ):
+                response = model.generate_content(
+                    contents, request_options={"timeout": timeout}
+                )
+                # raises if the response was blocked, so it's retried as well
+                response.text
+            return response
+
+        return retry(f"{youtube_id} - {kind}", request, deadline)
+
+    def get_timestamps(self, youtube_id, deadline=None):
+        windows, end = self.get_transcript(youtube_id, deadline)
+        return self.get_chapters(youtube_id, windows, end, deadline)
+
+    def get_transcript(self, youtube_id, deadline=None):
+        # First half of get_timestamps: returns the merged transcript windows and
+        # the length of the video (in seconds), so the caller can decide when to
+        # run the second half (get_chapters) depending on the length.
+        self.reload()
+        data = self._get_transcript(youtube_id, deadline)
+        windows = self._merge_transcript(data)
+        end = transcript_end(data)
+        if traffic_log.enabled:
+            traffic_log.record(
+                "transcript",
+                video=youtube_id,
+                end=end,
+                windows=len(windows),
+                chars=sum(len(text) for _, text in windows),
+            )
+        return windows, end
+
+    def is_long_video(self, end):
+        long_video_sec = int(os.environ.get("LONG_VIDEO_SEC", DEFAULT_LONG_VIDEO_SEC))
+        return bool(long_video_sec) and end > long_video_sec
+
+    def get_chapters(self, youtube_id, windows, end, deadline=None):
+        if self.is_long_video(end):
+            return self._get_timestamps_long(youtube_id, windows, end, deadline)
+
+        transcript = self._get_transcript_part(
+            youtube_id, encode_windows(windows), deadline
+        )
+
+        if os.environ.get("GEMINI_SINGLE_SHOT", "").lower() in ("1", "true", "yes"):
+            try:
+                return self._get_timestamps_single_shot(
+                    youtube_id, transcript, end, deadline
+                )
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                logging.warning(
+                    f"{youtube_id} - Single-shot chaptering failed, falling back to the chat. {e}"
+                )
+        return self._get_timestamps_chat(youtube_id, transcript, deadline)
+
+    def _request_chapters(self, youtube_id, transcript, instructions, deadline=None):
+        model = self._get_model(response_mime_type="application/json")
+        response = self._generate(
+            youtube_id,
+            model,
+            [
+                transcript,
+                f"Attached you have the transcript of a YouTube video. It's a JSON array where each element is a fragment of the video as [start, text]: start - the second in the video where the fragment begins, text - what is said, meaning the actual transcript.\n\n{instructions} Answer with a JSON array where each element is an object with the properties: start - the second in the video where the chapter begins, as an integer, and title - a short title for the chapter (a few words). Don't make it too granular: only have a chapter every few minutes, with just the big picture.",
+            ],
+            "chapters",
+            deadline,
+        )
+        logging.info(f"{youtube_id} - {response.text} - {len(response.text)=}")
+        return parse_chapters(response.text)
+
+    def _get_timestamps_single_shot(
+        self, youtube_id, transcript, end=None, deadline=None
+    ):
+        # One request for a structured chapter list, then the list is shortened
+        # locally (see chapters.fit_chapters) instead of asking the LLM to do it.
+        logging.info(f"{youtube_id} - Requesting the chapters")
+        chapters = self._request_chapters(
+            youtube_id,
+            transcript,
+            f"Split the video into its main chapters based on that transcript. The first chapter starts at 0. The chapters will be posted as lines like \"1:12:53 - How to learn AI\" in a message of at most {self.max_response_length} characters, so aim for a list that fits.",
+            deadline,
+        )
+        return fit_chapters(chapters, self.max_response_length, end)
+
+    def _get_timestamps_long(self, youtube_id, windows, end, deadline=None):
+        # Map-reduce for long videos: the transcript is split in time ordered chunks,
+        # the chunks are chaptered concurrently and the partial chapter lists are
+        # merged locally until they fit in a reply.
+        chunk_sec = int(
+            os.environ.get("LONG_VIDEO_CHUNK_SEC", DEFAULT_LONG_VIDEO_CHUNK_SEC)
+        )
+        concurrency = int(
+            os.environ.get("LONG_VIDEO_CONCURRENCY", DEFAULT_LONG_VIDEO_CONCURRENCY)
+        )
+        chunks = split_windows(windows, chunk_sec)
+        del windows
+        max_chapters = max(self.max_response_length // AVG_CHAPTER_LINE_LENGTH, 1)
+        per_chunk = max(-(-max_chapters // len(chunks)), 1)
+        logging.info(
+            f"{youtube_id} - Long video ({end}s), chaptering {len(chunks)} chunks"
+        )
+
+        def request_chunk(i):
+            chunk = chunks[i]
+            return self._request_chapters(
+                youtube_id,
+                encode_windows(chunk),
+                f"This is part {i + 1} of {len(chunks)} of the transcript, from second {chunk[0][0]} to second {chunk[-1][0]}. Split this part into its main chapters based on that transcript, with at most {per_chunk} chapters. Use the seconds from the transcript as they are for the start of each chapter.",
+                deadline,
+            )
+
+        with ThreadPoolExecutor(
+            max_workers=max(concurrency, 1), thread_name_prefix="long-video"
+        ) as executor:
+            partials = list(executor.map(request_chunk, range(len(chunks))))
+
+        chapters = [chapter for partial in partials for chapter in partial]
+        return fit_chapters(chapters, self.max_response_length, end)
+
+    def _get_timestamps_chat(self, youtube_id, transcript, deadline=None):
+        model = self._get_model()
         initial_message = {
             "role": "user",
             "parts": [
-                files[0],
-                "Attached you have the transcript of a YouTube video. It's a JSON file that has the following properties: text - what is said, meaning the actual transcript, start: the second of that fragment in the video.\n\nI want you to make a summary of the video based on that transcript data and also include the timestamps (make sure they are in HH:MM:SS format), meaning between what hour, minute and second in the video a generated topic/idea is mentioned. Make the topics short. Have lots of topics. Have one topic per line and each line starts with the timestamps.\n\nHere is an example of how your response look like. Pay attention to the format. This is the summary for another video:\n\n0:00 - Introduction\n13:03- 12 startups in 12 months\n36:37 - Photo AI\n1:12:53 - How to learn AI\n2:03:24 - Monetize your website\n3:01:34 - Productivity\n3:41:21 - Advice for young people\n\nDon't make it too granular. Extract the main ideas/chapters and present them. Only have a chapter at every few minutes, like in the example. Mention as timestamp the beginning of each chapter. See the provided example from above for a better understanding.\n",
+                transcript,
+                "Attached you have the transcript of a YouTube video. It's a JSON array where each element is a fragment of the video as [start, text]: start - the second in the video where the fragment begins, text - what is said, meaning the actual transcript.\n\nI want you to make a summary of the video based on that transcript data and also include the timestamps (make sure they are in HH:MM:SS format), meaning between what hour, minute and second in the video a generated topic/idea is mentioned. Make the topics short. Have lots of topics. Have one topic per line and each line starts with the timestamps.\n\nHere is an example of how your response look like. Pay attention to the format. This is the summary for another video:\n\n0:00 - Introduction\n13:03- 12 startups in 12 months\n36:37 - Photo AI\n1:12:53 - How to learn AI\n2:03:24 - Monetize your website\n3:01:34 - Productivity\n3:41:21 - Advice for young people\n\nDon't make it too granular. Extract the main ideas/chapters and present them. Only have a chapter at every few minutes, like in the example. Mention as timestamp the beginning of each chapter. See the provided example from above for a better understanding.\n",
             ],
         }
         
         MAX_RESPONSE_LENGTH = self.max_response_length
-
-        chat_session = model.start_chat(history=[])
-        response = chat_session.send_message(initial_message["parts"])
+        # The conversation is kept here and sent whole with every request (the
+        # transcript included, as a chat session would), so a request that
+        # times out can be retried without leaving the conversation half updated.
+        history = [initial_message]
+        response = self._generate(youtube_id, model, history, "chat_turn_1", deadline)
         logging.info(f"{youtube_id} - First response received - {len(response.text)=}")
-        chat_session.history.append({"role": "model", "parts": [response.text]})
+        history.append({"role": "model", "parts": [response.text]})
 
         follow_up_message = f"That's good, but it's too granular. The full response must have less than {MAX_RESPONSE_LENGTH} characters, including new lines. Extract the main ideas/chapters and present them. Only have a chapter at every few minutes, like in the example. Mention as timestamp the beginning of each chapter. See the provided example from above for a better understanding. Answer only with the timestamps and chapters, nothing else and remember to make the response short enought to not exceed {MAX_RESPONSE_LENGTH} characters."
-        response = chat_session.send_message(follow_up_message)
+        history.append({"role": "user", "parts": [follow_up_message]})
+        response = self._generate(youtube_id, model, history, "chat_turn_2", deadline)
         logging.info(f"{youtube_id} - Seconds response received - {len(response.text)=}")
-        chat_session.history.append({"role": "model", "parts": [response.text]})
+        history.append({"role": "model", "parts": [response.text]})
         
         follow_up_message = f"Make it even shorter. Just merge chapters into bigger categories. Provide the final response. Only few chapters with just the big picture."
-        response = chat_session.send_message(follow_up_message)
+        history.append({"role": "user", "parts": [follow_up_message]})
+        response = self._generate(youtube_id, model, history, "chat_turn_3", deadline)
         logging.info(f"{youtube_id} - {response.text} - {len(response.text)=}")
         max_len_resp = response.text[:MAX_RESPONSE_LENGTH]
         if max_len_resp != response.text:
             return max_len_resp[:max_len_resp.rfind("\n")]
         return max_len_resp
+
+    async def _run_async(self, method, worker_function, *args):
+        # The transcript and Gemini clients are blocking, so the pipeline runs on
+        # the executor and the event loop stays free for the other tasks.
+        loop = asyncio.get_running_loop()
+        if isinstance(self.executor, ProcessPoolExecutor):
+            return await loop.run_in_executor(
+                self.executor, worker_function, self.max_response_length, *args
+            )
+        return await loop.run_in_executor(self.executor, method, *args)
+
+    async def get_transcript_async(self, youtube_id, deadline=None):
+        return await self._run_async(
+            self.get_transcript, _get_transcript_in_worker, youtube_id, deadline
+        )
+
+    async def get_chapters_async(self, youtube_id, windows, end, deadline=None):
+        return await self._run_async(
+            self.get_chapters,
+            _get_chapters_in_worker,
+            youtube_id,
+            windows,
+            end,
+            deadline,
+        )